@@ -60,4 +60,18 @@ classdef FIGRL
         
      
     end 
+    
+    methods (Static)
+        
+        function edges = load_edges(path)
+            
+            % Reads a raw int64 edge file written by save_edge_array
+            % (inductiveGRL.graphconstruction) into a (number of edges x 2)
+            % matrix, without any text parsing.
+            fid = fopen(path, 'r', 'ieee-le');
+            edges = double(fread(fid, [2, Inf], 'int64=>int64'))';
+            fclose(fid);
+        end
+        
+    end
 end
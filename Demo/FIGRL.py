@@ -5,12 +5,147 @@ Created on Fri Sep 18 13:30:24 2020
 @author: Hendrik
 """
 
+import collections
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 import networkx as nx
 import pandas as pd
 import scipy
-from scipy.sparse import coo_matrix
-import collections
+try:
+    from inductiveGRL.instrumentation import stage
+except ImportError:
+    # inductiveGRL releases without instrumentation: stages are not recorded
+    class _NullStage():
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def add(self, **counts):
+            pass
+
+    def stage(name, **counts):
+        return _NullStage()
+
+
+class Sketch():
+    """ This class defines the random sketch matrix S of FIGRL from a seed, so that any row can be computed on demand.
+    Entry (i, j) only depends on the seed, the node id i and the column j, hence the sketch covers every possible
+    integer node id and new node ids extend it deterministically without storing the dense matrix.
+    ----------
+    intermediate_dimension : int
+        The number of columns of the sketch
+    seed : int
+        The seed from which all entries are derived
+    base : ndarray, shape (number of nodes, intermediate dimension), optional
+        An explicit sketch for the first node ids; rows beyond it are derived from the seed
+    """
+    block_entries = 2**22
+
+    def __init__(self, intermediate_dimension, seed, base=None):
+        self.intermediate_dimension = intermediate_dimension
+        self.seed = int(seed)
+        self.base = None if base is None else np.asarray(base, dtype=np.float64)
+
+    @staticmethod
+    def __mix(z):
+        # splitmix64 finalizer; uint64 arithmetic wraps around by design
+        z = z + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+    def __generate(self, ids):
+        k = self.intermediate_dimension
+        h = (k + 1) // 2
+        key = self.__mix(np.array([self.seed], dtype=np.uint64))
+        counters = ids.astype(np.uint64)[:, None] * np.uint64(h) + np.arange(h, dtype=np.uint64)[None, :]
+        z = self.__mix(counters ^ key)
+        # Box-Muller transform on the two 32 bit halves of every hash gives two independent N(0,1) entries
+        radius = np.sqrt(-2*np.log(((z >> np.uint64(32)).astype(np.float64) + 1) / 2.0**32)) / np.sqrt(k)
+        angle = 2*np.pi*((z & np.uint64(0xFFFFFFFF)).astype(np.float64) / 2.0**32)
+        return np.hstack((radius*np.cos(angle), radius*np.sin(angle)))[:, :k]
+
+    def rows(self, ids):
+        """
+        This function returns the sketch rows for the given node ids.
+        
+        Parameters
+        ----------
+        ids : array-like of int
+            The integer node ids
+        Returns
+        ----------
+        S : ndarray, shape (len(ids), intermediate dimension)
+            The sketch rows, in the order of ids
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        S = np.empty((len(ids), self.intermediate_dimension))
+        step = max(1, self.block_entries // self.intermediate_dimension)
+        for start in range(0, len(ids), step):
+            S[start:start+step] = self.__generate(ids[start:start+step])
+        if self.base is not None:
+            known = ids < len(self.base)
+            S[known] = self.base[ids[known]]
+        return S
+
+    def __getitem__(self, ids):
+        return self.rows(ids)
+
+    def dot(self, ids, M):
+        """
+        This function returns S[ids].dot(M) while materializing only one block of sketch rows at a time.
+        
+        Parameters
+        ----------
+        ids : array-like of int
+            The integer node ids
+        M : ndarray, shape (intermediate dimension, number of columns)
+            The matrix the sketch rows are multiplied with
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        P = np.empty((len(ids), M.shape[1]))
+        step = max(1, self.block_entries // self.intermediate_dimension)
+        for start in range(0, len(ids), step):
+            P[start:start+step] = self.rows(ids[start:start+step]).dot(M)
+        return P
+
+
+def _sketch_rows(indptr, indices, data, sketch, block_edges):
+    """
+    This multiplies a block of rows of a CSR matrix with the sketch, generating the sketch rows of the columns it uses.
+    It is a module level function so that it can run in a worker thread or process.
+    
+    Parameters
+    ----------
+    indptr : ndarray
+        The CSR row pointers of the block (not necessarily starting at 0)
+    indices, data : ndarray
+        The column ids and values of the block
+    sketch : Sketch
+        The sketch the block is multiplied with
+    block_edges : int
+        At most this many entries are multiplied at once, which bounds the number of generated sketch rows
+    Returns
+    ----------
+    C: ndarray, shape (number of rows in the block, intermediate dimension)
+    """
+    number_of_rows = len(indptr) - 1
+    rows = np.repeat(np.arange(number_of_rows), np.diff(indptr))
+    C = np.zeros((number_of_rows, sketch.intermediate_dimension))
+    for p in range(0, len(rows), block_edges):
+        cols = np.asarray(indices[p:p+block_edges], dtype=np.int64)
+        unique, inverse = np.unique(cols, return_inverse=True)
+        M = scipy.sparse.csr_matrix((data[p:p+block_edges], (rows[p:p+block_edges], inverse)), shape=(number_of_rows, len(unique)))
+        C += M.dot(sketch.rows(unique))
+    return C
+
+
+def _sketch_dot(sketch, ids, M):
+    return sketch.dot(ids, M)
 
 
 class FIGRL():
@@ -20,137 +155,391 @@ class FIGRL():
         The desired size of the resulting embeddings; together with the intermediate dimension it defines the approximation ratio
     intermediate_dimension : int
         The dimension of the matrix sketch M 
+    seed : int, optional
+        The seed of the sketch matrix; if None a seed is drawn from numpy's global random state
+    svd_solver : str
+        The singular value decomposition used on the sketched matrix (number of nodes x intermediate dimension):
+        'arpack' (scipy.sparse.linalg.svds), 'dense' (thin SVD through a QR decomposition) or 'randomized' (block power iteration)
+    tol : float
+        Tolerance of the SVD: passed to ARPACK (0 means machine precision); for 'randomized' the power iterations stop
+        once the relative change of the singular values drops below tol (0 runs all n_iter iterations). Unused by 'dense', which is exact.
+    n_iter : int
+        The maximal number of power iterations of the randomized SVD
+    n_jobs : int
+        The number of workers that compute the sketch products in row blocks
+    backend : str
+        'threads' or 'processes'; the workers generate the sketch rows of their block from the seed themselves
     Attributes
     ----------
-    St : ndarray, shape (number of training nodes, intermediate dimension)
-        Matrix of size # training nodes x intermediate dimension whose entries are independently drawn from N(0,1)
+    St : Sketch
+        Sketch of size # nodes x intermediate dimension whose entries are N(0,1)/sqrt(intermediate dimension), derived from the seed.
+        It is shared by the training and the inductive step, rows are computed only for the node ids that are used.
+    degrees : ndarray, shape (number of training nodes,)
+        The node degrees of the training graph
     V : ndarray, shape (final dimension, final dimension)
         The utter most right matrix of the singular value decomposition done on the normalized random walk matrix in the training step.
     sigma : ndarray, shape (final dimension, final dimension)
         The middle matrix of the singular value decomposition done on the normalized random walk matrix in the training step
     """
-    def __init__(self, embedding_size, intermediate_dimension):
+    block_edges = 2**18
+
+    def __init__(self, embedding_size, intermediate_dimension, seed=None, svd_solver='arpack', tol=0, n_iter=4, n_jobs=1, backend='threads'):
+        if svd_solver not in ('arpack', 'dense', 'randomized'):
+            raise ValueError("svd_solver should be one of 'arpack', 'dense' or 'randomized'.")
+        if backend not in ('threads', 'processes'):
+            raise ValueError("backend should be 'threads' or 'processes'.")
         self.embedding_size = embedding_size
         self.intermediate_dimension = intermediate_dimension
+        self.seed = np.random.randint(2**31 - 1) if seed is None else seed
+        self.svd_solver = svd_solver
+        self.tol = tol
+        self.n_iter = n_iter
+        self.n_jobs = n_jobs
+        self.backend = backend
         self.St = None
+        self.degrees = None
         self.V = None
         self.sigma = None
 
-    def fit(self, train_graph, S=None):
+    def fit(self, train_graph, S=None, store=None):
         """This function trains a figrl model.
         It returns the trained figrl model and a pandas datarame containing the embeddings generated for the train nodes.
         ----------
-        train_graph : NetworkX Object
-            The graph on which the training step is done on, containing only the seen training nodes.
+        train_graph : NetworkX Object or scipy sparse matrix
+            The graph on which the training step is done on, containing only the seen training nodes, or its adjacency matrix.
         S : ndarray, shape (number of training nodes, intermediate dimension)
-            A random matrix used to create the normalized random walk matrix; if non the fit definition creates a new one
+            A random matrix used to create the normalized random walk matrix; if None the seeded sketch is used.
+            Node ids beyond the given matrix are extended from the seed.
+        store : EmbeddingStore, optional
+            If given, the embeddings are also written to this store, keyed by node id.
         Returns
         -------
         figrl_train_emb : pandas Dataframe
             The embeddings created during the training step for the training nodes.
         """
         
-        A = nx.adjacency_matrix(train_graph)
+        A = train_graph if scipy.sparse.issparse(train_graph) else nx.adjacency_matrix(train_graph)
         n,m = A.shape
-        diags = A.sum(axis=1).flatten()
+        with stage('adjacency normalization', nodes=n, edges=A.nnz):
+            diags = A.sum(axis=1).flatten()
+            self.degrees = np.asarray(diags).ravel()
 
-        with scipy.errstate(divide='ignore'):
-           diags_sqrt = 1.0/np.lib.scimath.sqrt(diags)
-        diags_sqrt[np.isinf(diags_sqrt)] = 0
-        DH = scipy.sparse.spdiags(diags_sqrt, [0], n, n, format='csr')
+            with np.errstate(divide='ignore'):
+               diags_sqrt = 1.0/np.lib.scimath.sqrt(diags)
+            diags_sqrt[np.isinf(diags_sqrt)] = 0
+            DH = scipy.sparse.spdiags(diags_sqrt, [0], n, n, format='csr')
 
-        Normalized_random_walk = DH.dot(A.dot(DH))
-        if S is None:
-            S = np.random.randn(n, self.intermediate_dimension) / np.sqrt(self.intermediate_dimension)
-            #np.savetxt("S_train_matrix.csv", S, delimiter=",")
+            Normalized_random_walk = DH.dot(A.dot(DH))
+        self.St = Sketch(self.intermediate_dimension, self.seed, base=S)
 
-        C = Normalized_random_walk.dot(S)
+        with stage('sketch product', nodes=n, edges=A.nnz):
+            C = self.__sketch_product(Normalized_random_walk)
 
-        from scipy import sparse
-        sC = sparse.csr_matrix(C)
-
-        U, self.sigma, self.V = scipy.sparse.linalg.svds(sC, k=self.embedding_size, tol=0,which='LM')
+        with stage('svd', nodes=n):
+            U, self.sigma, self.V = self.__svd(C)
         self.V = self.V.transpose()
         self.sigma = np.diag(self.sigma)
         
-        figrl_train_emb = pd.DataFrame(U)
-        figrl_train_emb = figrl_train_emb.set_index(figrl_train_emb.index)
+        with stage('embedding assembly', nodes=n):
+            figrl_train_emb = pd.DataFrame(U)
+            figrl_train_emb = figrl_train_emb.set_index(figrl_train_emb.index)
         
-        self.sigma = np.array(self.sigma)
-        self.V = np.array(self.V)
-        self.St = np.array(S)
+            self.sigma = np.array(self.sigma)
+            self.V = np.array(self.V)
+            if store is not None:
+                store.put(figrl_train_emb.index, U)
         
         return figrl_train_emb
 
-    def __create_inductive_dict(self, inductive_data ,list_connected_node_types):
+    def __svd(self, C):
+        """
+        This computes the truncated singular value decomposition of the sketched matrix with the configured solver
         
+        Parameters
+        ----------
+        C : ndarray, shape (number of nodes, intermediate dimension)
+            The normalized random walk matrix multiplied with the sketch
+        Returns
+        ----------
+        U, sigma, Vt: ndarrays
+            The embedding_size leading singular triplets, in increasing order of singular value like scipy.sparse.linalg.svds
+        """
+        k = self.embedding_size
+        if self.svd_solver == 'arpack':
+            return scipy.sparse.linalg.svds(C, k=k, tol=self.tol, which='LM')
+
+        if self.svd_solver == 'dense':
+            # C = QR and R = U_r sigma Vt, so C has the right singular vectors of the small R and U = C V / sigma
+            R = np.linalg.qr(C, mode='r')
+            _, sigma, Vt = np.linalg.svd(R)
+        else:
+            # Block Krylov subspace [C W, (C C^T) C W, ...] followed by a Rayleigh-Ritz step
+            rng = np.random.default_rng(self.seed)
+            Q = np.linalg.qr(C.dot(rng.standard_normal((C.shape[1], min(C.shape[1], k + 10)))))[0]
+            blocks = [Q]
+            sigma = None
+            for _ in range(self.n_iter):
+                Q = np.linalg.qr(C.dot(np.linalg.qr(C.T.dot(Q))[0]))[0]
+                blocks.append(Q)
+                if self.tol > 0:
+                    previous = sigma
+                    K = np.linalg.qr(np.hstack(blocks))[0]
+                    sigma = np.linalg.svd(K.T.dot(C), compute_uv=False)[:k]
+                    if previous is not None and np.max(np.abs(sigma - previous) / sigma) < self.tol:
+                        break
+            K = np.linalg.qr(np.hstack(blocks))[0]
+            _, sigma, Vt = np.linalg.svd(K.T.dot(C), full_matrices=False)
+        sigma, Vt = sigma[:k], Vt[:k]
+        U = C.dot(Vt.T) / sigma
+        return U[:, ::-1], sigma[::-1], Vt[::-1]
+
+    def __sketch_product(self, M):
         """
-        This creates a collection of the inductive nodes as key and as values their interaction with other nodes in inductive step.
+        This computes M.dot(S) in row blocks, in parallel over n_jobs workers; only the sketch rows used by a block are generated
         
         Parameters
         ----------
-        inductive_data : pandas Dataframe
-            The row defines the incoming node, in the columns the different node types that can be connected to.
-        list_connected_node_types : numpy list of pandas Dataframes
-            The list contains the connected node collumns 
-            
+        M : scipy sparse matrix, shape (number of rows, number of nodes)
+            The matrix multiplied with the sketch
         Returns
         ----------
-        inductive_dict: collection.OrderedDictionary
-            The dictionay containing the inductive nodes as keys and the values their first degree neighbours
+        C: ndarray, shape (number of rows, intermediate dimension)
+        """
+        M = scipy.sparse.csr_matrix(M)
+        C = np.empty((M.shape[0], self.intermediate_dimension))
+        blocks = list(self.__row_blocks(M.indptr, self.block_edges))
+        tasks = ((M.indptr[start:end+1], M.indices[M.indptr[start]:M.indptr[end]], M.data[M.indptr[start]:M.indptr[end]], self.St, self.block_edges) for start, end in blocks)
+        for (start, end), block in zip(blocks, self.__map(_sketch_rows, tasks)):
+            C[start:end] = block
+        return C
+
+    @staticmethod
+    def __row_blocks(indptr, block_edges):
         """
+        This yields (start, end) row ranges holding at most block_edges entries, or a single row if that row has more
+        """
+        n = len(indptr) - 1
+        start = 0
+        while start < n:
+            end = max(start+1, int(np.searchsorted(indptr, indptr[start] + block_edges, side='right')) - 1)
+            end = min(end, n)
+            yield start, end
+            start = end
+
+    def __map(self, function, tasks):
+        """
+        This applies function to every argument tuple in tasks over n_jobs workers and yields the results in order,
+        keeping at most 2*n_jobs tasks in flight so memory stays bounded
+        """
+        if self.n_jobs == 1:
+            for task in tasks:
+                yield function(*task)
+            return
+        Executor = ThreadPoolExecutor if self.backend == 'threads' else ProcessPoolExecutor
+        with Executor(self.n_jobs) as executor:
+            pending = collections.deque()
+            for task in tasks:
+                pending.append(executor.submit(function, *task))
+                if len(pending) >= 2*self.n_jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def fit_out_of_core(self, edges, number_of_nodes=None, directory=None, block_edges=None):
+        """This function trains a figrl model on an edge list that is read from disk in chunks.
+        Only arrays of length number of nodes and a (intermediate dimension x intermediate dimension) Gram matrix are kept
+        in memory; the graph is stored as an on-disk CSR structure and the sketched matrix is computed one row block at a time.
+        The SVD is obtained from the eigendecomposition of the Gram matrix of the sketched matrix, whose row blocks are
+        computed twice (once for the Gram matrix, once for the embeddings) instead of being stored.
+        ----------
+        edges : str, ndarray or 2-tuple of str/ndarray
+            Path to a .npy or raw int64 edge file (loaded memory-mapped, see save_edge_array) or array of shape
+            (number of edges, 2) with integer node ids, or a pair of .npy paths/arrays holding the source and target ids.
+            Every undirected edge is listed once.
+        number_of_nodes : int, optional
+            The number of nodes; defaults to the largest node id + 1
+        directory : str, optional
+            The directory for the on-disk CSR structure and the embeddings; defaults to a new temporary directory
+        block_edges : int, optional
+            The number of adjacency entries processed per chunk, which bounds the working memory (about block_edges x intermediate
+            dimension x 8 bytes per worker for the sketch rows); defaults to FIGRL.block_edges
+        Returns
+        -------
+        figrl_train_emb : numpy memmap, shape (number of nodes, embedding size)
+            The embeddings created during the training step for the training nodes, stored in directory/embeddings.npy
+        """
+        block_edges = self.block_edges if block_edges is None else block_edges
+        sources, targets = self.__load_edges(edges)
+        if number_of_nodes is None:
+            number_of_nodes = 1 + max((int(max(chunk.max() for chunk in self.__chunks(ids, block_edges))) if len(ids) else -1) for ids in (sources, targets))
+        n = number_of_nodes
+        directory = tempfile.mkdtemp() if directory is None else directory
+        with stage('graph build', nodes=n, edges=len(sources)):
+            indptr, indices = self.__build_csr(sources, targets, n, directory, block_edges)
+
+        with stage('adjacency normalization', nodes=n, edges=len(indices)):
+            self.degrees = np.diff(indptr).astype(np.float64)
+            with np.errstate(divide='ignore'):
+                diags_sqrt = 1.0/np.sqrt(self.degrees)
+            diags_sqrt[np.isinf(diags_sqrt)] = 0
+        self.St = Sketch(self.intermediate_dimension, self.seed)
+
+        gram = np.zeros((self.intermediate_dimension, self.intermediate_dimension))
+        with stage('sketch product', nodes=n, edges=len(indices)):
+            for start, C in self.__sketch_blocks(indptr, indices, diags_sqrt, block_edges):
+                gram += C.T.dot(C)
+        with stage('svd', nodes=n):
+            eigenvalues, V = np.linalg.eigh(gram)
+        # eigh sorts increasingly, which is also the order scipy.sparse.linalg.svds returns
+        sigma = np.sqrt(np.clip(eigenvalues[-self.embedding_size:], 0, None))
+        self.V = V[:, -self.embedding_size:]
+        self.sigma = np.diag(sigma)
+
+        with stage('embedding assembly', nodes=n, edges=len(indices)):
+            figrl_train_emb = np.lib.format.open_memmap(os.path.join(directory, 'embeddings.npy'), mode='w+', dtype=np.float64, shape=(n, self.embedding_size))
+            for start, C in self.__sketch_blocks(indptr, indices, diags_sqrt, block_edges):
+                figrl_train_emb[start:start+len(C)] = C.dot(self.V) / sigma
+            figrl_train_emb.flush()
+        return figrl_train_emb
+
+    @staticmethod
+    def __load_edges(edges):
+        def load(a):
+            if not isinstance(a, (str, os.PathLike)):
+                return a
+            if str(a).endswith('.npy'):
+                return np.load(a, mmap_mode='r')
+            # raw little-endian int64 file as written by inductiveGRL.graphconstruction.save_edge_array
+            return np.memmap(a, dtype='<i8', mode='r').reshape(-1, 2)
+        if isinstance(edges, tuple):
+            return load(edges[0]), load(edges[1])
+        edges = load(edges)
+        return edges[:, 0], edges[:, 1]
+
+    @staticmethod
+    def __chunks(array, size):
+        for start in range(0, len(array), size):
+            yield np.asarray(array[start:start+size])
+
+    def __build_csr(self, sources, targets, n, directory, block_edges):
+        """
+        This writes the symmetric adjacency structure of the edge list to disk as CSR arrays with a counting sort,
+        reading the edges in chunks. A self-loop is stored once, as in the adjacency matrix of the in-memory fit.
         
-        inductive_dict = {}
-        for node in inductive_data.index:
-            for i in list_connected_node_types:
-                if i.loc[node] != None:
-                    if node in inductive_dict:
-                        inductive_dict[node].append(i.loc[node])  
-                    else:
-                        inductive_dict[node] = [i.loc[node]]
-        inductive_dict = collections.OrderedDict(sorted(inductive_dict.items()))
-        return inductive_dict
-    
-    def __get_vector(self, inductive_dict, train_degrees, max_id):
+        Returns
+        ----------
+        indptr: ndarray, shape (n+1,)
+        indices: numpy memmap, shape (2*number of edges,)
+        """
+        counts = np.zeros(n, dtype=np.int64)
+        for s, t in zip(self.__chunks(sources, block_edges), self.__chunks(targets, block_edges)):
+            # counted per chunk with a sort, so every chunk costs O(block_edges) instead of O(n)
+            unique, chunk_counts = np.unique(np.concatenate((s, t[s != t])), return_counts=True)
+            counts[unique] += chunk_counts
+        indptr = np.zeros(n+1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        del counts
+
+        dtype = np.int32 if n < 2**31 else np.int64
+        indices = np.lib.format.open_memmap(os.path.join(directory, 'indices.npy'), mode='w+', dtype=dtype, shape=(int(indptr[-1]),))
+        cursor = indptr[:-1].copy()
+        for s, t in zip(self.__chunks(sources, block_edges), self.__chunks(targets, block_edges)):
+            loop = s == t
+            rows = np.concatenate((s, t[~loop]))
+            cols = np.concatenate((t, s[~loop]))
+            order = np.argsort(rows, kind='stable')
+            rows, cols = rows[order], cols[order]
+            unique, first, counts = np.unique(rows, return_index=True, return_counts=True)
+            # position of every entry = cursor of its row + its rank among the entries of that row in this chunk
+            rank = np.arange(len(rows)) - np.repeat(first, counts)
+            indices[cursor[rows] + rank] = cols
+            cursor[unique] += counts
+        indices.flush()
+        return indptr, indices
+
+    def __sketch_blocks(self, indptr, indices, diags_sqrt, block_edges):
+        """
+        This yields the rows of the normalized random walk matrix multiplied with the sketch, one row block at a time;
+        a block holds at most block_edges adjacency entries, unless a single row has more, which is then summed in segments
+        """
+        def tasks(blocks):
+            for start, end in blocks:
+                cols = np.asarray(indices[indptr[start]:indptr[end]], dtype=np.int64)
+                rows = np.repeat(np.arange(start, end), np.diff(indptr[start:end+1]))
+                yield indptr[start:end+1], cols, diags_sqrt[rows] * diags_sqrt[cols], self.St, block_edges
+
+        blocks = list(self.__row_blocks(indptr, block_edges))
+        for (start, end), C in zip(blocks, self.__map(_sketch_rows, tasks(blocks))):
+            yield start, C
+
+    def __get_degrees(self, graph, size):
+        """
+        This returns the node degrees of the inductive+train graph as an array indexed by integer node id
+        
+        Parameters
+        ----------
+        graph : NetworkX Object, scipy sparse matrix, ndarray or object with a get_degrees() method
+            The graph on which FIGRL is deployed (training + inductive nodes), its adjacency matrix or its degree array
+        size: int
+            The minimal length of the returned array
+        Returns
+        ----------
+        degrees: ndarray
+            The degree of every node, 0 for ids that are not part of the graph
+        """
+        if isinstance(graph, np.ndarray):
+            found = graph
+        elif scipy.sparse.issparse(graph):
+            found = np.asarray((graph != 0).sum(axis=1)).ravel()
+        elif hasattr(graph, 'get_degrees'):
+            found = graph.get_degrees()
+        else:
+            nodes, found = zip(*graph.degree()) if graph.number_of_nodes() else ((), ())
+            nodes = np.fromiter(nodes, dtype=np.int64, count=len(nodes))
+            degrees = np.zeros(max(size, nodes.max()+1 if len(nodes) else 0), dtype=np.float64)
+            degrees[nodes] = found
+            return degrees
+        degrees = np.zeros(max(size, len(found)), dtype=np.float64)
+        degrees[:len(found)] = found
+        return degrees
+
+    def __get_vector(self, neighbours, degrees, max_id):
         """
         This creates the sparse vector_matrix used in the inductive step
         
         Parameters
         ----------
-        inductive_dict :Ordered dictionary
-            The dictionay containing the inductive nodes as keys and the values their first degree neighbours
-        train_degrees : Ordered dictionary
-            A dictionay containing the degrees of all the nodes in the inductive+train graph
+        neighbours : ndarray, shape (number of inductive nodes, number of connected node types)
+            The integer ids of the first degree neighbours of every inductive node, NaN/None where there is no neighbour
+        degrees : ndarray
+            The degrees of all the nodes in the inductive+train graph, indexed by integer id
         max_id: int
             The largest integer number used as ID 
         Returns
         ----------
-        coo_matrix: scipy coo matrix
-            This function returns a sparse coordination matrix with the normalized random walk vectors for the inductive nodes
-        """
-        row  = []
-        col  = []
-        data = []
-        i = 0
-        for node, v in inductive_dict.items():
-            for n in v:
-                if n is not None:
-                    row.append(i)
-                    col.append(n)
-                    if n > max_id:
-                        max_id = int(n)
-                        #calculate value
-                    inductive_degree = len([x for x in v if x != None])
-                    value = 1/np.sqrt(inductive_degree)
-                    value = value * (1/np.sqrt(train_degrees[n]))
-                    data.append(value)
-            i+=1
-        row = np.array(row)
-        col = np.array(col)
-        data = np.array(data)
-        return coo_matrix((data, (row, col)), shape=(len(inductive_dict), max_id+1))
-
-    def predict(self, graph, inductive_data, list_connected_node_types, maxid, inductive_index):
+        csr_matrix: scipy csr matrix
+            The sparse matrix with the normalized random walk vectors for the inductive nodes, one column per distinct neighbour
+        inductive_degrees: ndarray
+            The number of neighbours of every inductive node
+        neighbour_ids: ndarray
+            The sorted integer ids of the distinct neighbours, one per column of the csr matrix
+        """
+        mask = pd.notna(neighbours)
+        inductive_degrees = mask.sum(axis=1)
+        row, col = np.nonzero(mask)
+        col = neighbours[row, col].astype(np.int64)
+        if len(col) > 0:
+            max_id = max(max_id, int(col.max()))
+        if len(degrees) <= max_id:
+            degrees = np.concatenate((degrees, np.zeros(max_id+1-len(degrees))))
+
+        data = 1/np.sqrt(inductive_degrees[row]) * (1/np.sqrt(degrees[col]))
+        # Only the neighbours that occur get a column, matching the rows of St.rows(neighbour_ids)
+        neighbour_ids, col = np.unique(col, return_inverse=True)
+        v = scipy.sparse.csr_matrix((data, (row, col)), shape=(len(neighbours), len(neighbour_ids)))
+        return v, inductive_degrees, neighbour_ids
+
+    def predict(self, graph, inductive_data, list_connected_node_types, maxid, inductive_index, store=None):
         """
         This function predicts embeddings for unseen nodes using a fitted figrl model.
         It returns the embeddings for these unseen nodes. 
@@ -158,49 +547,127 @@ class FIGRL():
         
         Parameters
         ----------
-        graph : NetworkX Object
-            The graph on which FIGRL is deployed (training + inductive nodes)
+        graph : NetworkX Object, scipy sparse matrix or ndarray
+            The graph on which FIGRL is deployed (training + inductive nodes), its adjacency matrix or the array of its node degrees indexed by integer id
         inductive_data : pandas Dataframe
             The row defines the incoming node, in the columns the different node types that can be connected to.
         list_connected_node_types : numpy list of pandas Dataframes
             The list contains the connected node collumns 
         maxid: int
-            The maximum integer ID for the training and inductive set
+            The maximum integer ID for the training and inductive set, used to size the degree array
         inductive_index: RangeIndex
-            The inductive indexes for the embeddings
+            The inductive indexes for the embeddings, in the order of the rows of inductive_data
+        store : EmbeddingStore, optional
+            If given, the embeddings are also written to this store, keyed by inductive_index.
         Returns
         ----------
         figrl_inductive_emb: pandas Dataframe
             The embeddings created during the training step for the inductive nodes.
         """
-        inductive_dict = self.__create_inductive_dict(inductive_data, list_connected_node_types)
+        neighbours = np.column_stack([np.asarray(i.loc[inductive_data.index]) for i in list_connected_node_types])
+        with stage('adjacency normalization', nodes=maxid+1):
+            degrees = self.__get_degrees(graph, maxid+1)
         
-        degrees = nx.degree(graph)
-        train_degrees = dict(degrees)
-        train_degrees = collections.OrderedDict(sorted(train_degrees.items()))
+        with stage('inductive projection', nodes=len(neighbours)):
+            U = self.project(neighbours, degrees, maxid)
         
-        v = self.__get_vector(inductive_dict, train_degrees, maxid)
+        with stage('embedding assembly', nodes=len(neighbours)):
+            figrl_inductive_emb = pd.DataFrame(U, index = inductive_index)
+            if store is not None:
+                store.put(inductive_index, U)
+    
+        return figrl_inductive_emb    
 
-        S = np.random.randn(maxid+1, self.intermediate_dimension) / np.sqrt(self.intermediate_dimension)
+    def project(self, neighbours, degrees, maxid=0):
+        """
+        This function computes the inductive embeddings from the integer ids of the neighbours of the unseen nodes.
+        It is the array-level core of predict, shared with StreamingFIGRL.
         
-        inductive_degrees = []
+        Parameters
+        ----------
+        neighbours : ndarray, shape (number of inductive nodes, number of connected node types)
+            The integer ids of the first degree neighbours of every inductive node, NaN/None where there is no neighbour
+        degrees : ndarray
+            The degrees of all the nodes in the inductive+train graph, indexed by integer id
+        maxid: int
+            The maximum integer ID for the training and inductive set
+        Returns
+        ----------
+        U: ndarray, shape (number of inductive nodes, embedding size)
+            The embeddings of the inductive nodes, in the order of the rows of neighbours
+        """
+        v, inductive_degrees, neighbour_ids = self.__get_vector(neighbours, degrees, maxid)
+
+        with np.errstate(divide='ignore'):
+            sqrt_d_inv = np.where(inductive_degrees > 0, 1/np.sqrt(inductive_degrees), 0)
+
+        # v.dot(S).dot(V) evaluated as v.dot(S.dot(V)), which avoids the dense (inductive nodes x intermediate dimension) product
+        step = max(1, Sketch.block_entries // self.intermediate_dimension)
+        tasks = ((self.St, neighbour_ids[start:start+step], self.V) for start in range(0, len(neighbour_ids), step))
+        SV = np.concatenate([np.empty((0, self.V.shape[1]))] + list(self.__map(_sketch_dot, tasks)))
+        U =(v.dot(SV)).dot(np.linalg.inv(self.sigma))
+        return sqrt_d_inv[:, None] * U
 
-        for l in inductive_dict.values():
-            x = 0
-            for i in l:
-                if i is not None:
-                    x+=1
-            inductive_degrees.append(x)
-    
 
-        sqrt_d_inv = np.array([1/np.sqrt(degree)  if degree > 0 else 0 for degree in inductive_degrees])
-        sqrt_d_inv = scipy.sparse.spdiags(sqrt_d_inv,0, sqrt_d_inv.size, sqrt_d_inv.size)
+class StreamingFIGRL():
+    """ This class scores micro-batches of incoming transactions with a fitted FIGRL model.
+    The client and merchant degrees are kept in a compact array that is updated with every batch, so the cost of a batch
+    only depends on its size and never on the size of the graph seen so far.
+    ----------
+    model : FIGRL
+        A fitted FIGRL model
+    node_ids : dict
+        Maps the client and merchant labels of the training graph to their integer node ids (the ids used to fit the model)
+    degrees : ndarray, optional
+        The degree of every training node, indexed by integer id; defaults to the degrees stored by model.fit
+    Attributes
+    ----------
+    degrees : ndarray
+        The degree counters; unseen clients and merchants get the next free integer id and a counter of their own
+    """
+    def __init__(self, model, node_ids, degrees=None):
+        self.model = model
+        self.node_ids = dict(node_ids)
+        degrees = np.asarray(model.degrees if degrees is None else degrees, dtype=np.int64)
+        self.number_of_nodes = max(len(degrees), max(self.node_ids.values(), default=-1) + 1)
+        self.degrees = np.zeros(max(1, 2*self.number_of_nodes), dtype=np.int64)
+        self.degrees[:len(degrees)] = degrees
 
-        p = v.dot(S)
-        U =(p.dot(self.V)).dot(np.linalg.inv(self.sigma))
-        U = sqrt_d_inv.dot(U)
+    def __get_ids(self, labels):
+        ids = np.empty(len(labels), dtype=np.int64)
+        for i, label in enumerate(labels):
+            node_id = self.node_ids.get(label)
+            if node_id is None:
+                node_id = self.node_ids[label] = self.number_of_nodes
+                self.number_of_nodes += 1
+            ids[i] = node_id
+        if self.number_of_nodes > len(self.degrees):
+            # grow geometrically so that appending nodes stays amortized O(1)
+            self.degrees = np.concatenate((self.degrees, np.zeros(max(len(self.degrees), self.number_of_nodes), dtype=np.int64)))
+        return ids
+
+    def score(self, batch):
+        """
+        This function adds a micro-batch of transactions to the degree counters and returns their embeddings.
         
-        figrl_inductive_emb = pd.DataFrame(U, index = inductive_index)
-    
-        return figrl_inductive_emb    
+        Parameters
+        ----------
+        batch : iterable of (transaction, client, merchant) tuples or a pandas Dataframe with these three columns
+            The incoming transactions
+        Returns
+        ----------
+        figrl_inductive_emb: pandas Dataframe
+            The embeddings of the transactions in the batch, indexed by transaction
+        """
+        if isinstance(batch, pd.DataFrame):
+            transactions, clients, merchants = (batch.iloc[:, i].to_numpy() for i in range(3))
+        else:
+            batch = list(batch)
+            transactions, clients, merchants = zip(*batch) if batch else ((), (), ())
+        neighbours = np.column_stack((self.__get_ids(clients), self.__get_ids(merchants)))
+
+        ids, counts = np.unique(neighbours, return_counts=True)
+        self.degrees[ids] += counts
 
+        U = self.model.project(neighbours, self.degrees)
+        return pd.DataFrame(U, index=pd.Index(transactions))
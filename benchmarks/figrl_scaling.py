@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmark for the parallel sketch products and the SVD solvers of FIGRL.
+
+Times FIGRL.fit (normalized adjacency times sketch + dense SVD) and FIGRL.predict
+on a synthetic tripartite transaction graph for an increasing number of workers
+and prints the throughput per worker count.
+
+Then sweeps the SVD solvers and their tolerances (SOLVERS) with the maximal number
+of workers and prints, per configuration, the wall time of fit and of its SVD stage
+and the difference from the embeddings of exact ARPACK (tol=0): the largest relative
+singular value error, the sine of the largest principal angle between the embedding
+subspaces, and the relative error of the train and inductive embeddings after
+aligning the sign of every dimension.
+
+Usage: python benchmarks/figrl_scaling.py [number of transactions] [max workers] [threads|processes]
+
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Demo'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from FIGRL import FIGRL
+from inductiveGRL.instrumentation import Profiler
+
+# the SVD solver configurations of the sweep, as keyword arguments of FIGRL; the first one is the reference
+SOLVERS = [{'svd_solver': 'arpack', 'tol': 0},
+           {'svd_solver': 'arpack', 'tol': 1e-6},
+           {'svd_solver': 'arpack', 'tol': 1e-3},
+           {'svd_solver': 'dense'},
+           {'svd_solver': 'randomized', 'n_iter': 1},
+           {'svd_solver': 'randomized', 'n_iter': 2},
+           {'svd_solver': 'randomized', 'n_iter': 4},
+           {'svd_solver': 'randomized', 'n_iter': 8},
+           {'svd_solver': 'randomized', 'n_iter': 16, 'tol': 1e-3},
+           {'svd_solver': 'randomized', 'n_iter': 16, 'tol': 1e-6}]
+
+
+def tripartite_graph(number_of_transactions, seed=0):
+    rng = np.random.default_rng(seed)
+    clients, merchants = max(1, number_of_transactions//10), max(1, number_of_transactions//100)
+    client = rng.zipf(1.5, number_of_transactions) % clients
+    merchant = clients + rng.zipf(1.5, number_of_transactions) % merchants
+    transaction = clients + merchants + np.arange(number_of_transactions)
+    n = clients + merchants + number_of_transactions
+    rows = np.concatenate((client, merchant, transaction, transaction))
+    cols = np.concatenate((transaction, transaction, client, merchant))
+    A = scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    inductive = pd.DataFrame({'client': rng.zipf(1.5, number_of_transactions) % clients,
+                              'merchant': clients + rng.zipf(1.5, number_of_transactions) % merchants})
+    return A, inductive
+
+
+def relative_error(embedding, reference):
+    # the sign of every dimension of an SVD is arbitrary, so it is aligned with the reference first
+    signs = np.where(np.sum(embedding*reference, axis=0) < 0, -1.0, 1.0)
+    return np.linalg.norm(embedding*signs - reference)/np.linalg.norm(reference)
+
+
+def subspace_error(U, reference):
+    # sine of the largest principal angle between the column spaces, insensitive to rotations within (near) repeated singular values
+    Q, Q_reference = np.linalg.qr(U)[0], np.linalg.qr(reference)[0]
+    residual = Q - Q_reference.dot(Q_reference.T.dot(Q))
+    return np.linalg.norm(residual, 2)
+
+
+def solver_sweep(A, degrees, inductive, n_jobs, backend, solvers=SOLVERS):
+    print('solver      tol     n_iter  fit (s)  svd (s)  sigma error  subspace error  train error  inductive error')
+    reference = None
+    for params in solvers:
+        model = FIGRL(64, 400, seed=0, n_jobs=n_jobs, backend=backend, **params)
+        with Profiler(memory=False) as profiler:
+            train = model.fit(A).to_numpy()
+        svd_time = sum(s['seconds'] for s in profiler.report()['stages'] if s['stage'] == 'svd')
+        predicted = model.predict(degrees, inductive, [inductive.client, inductive.merchant], A.shape[0], inductive.index).to_numpy()
+        sigma = np.diag(model.sigma)
+        reference = reference or (train, predicted, sigma)
+        print('%-10s  %-6g  %6s  %7.2f  %7.2f  %11.2e  %14.2e  %11.2e  %15.2e' % (
+              params['svd_solver'], params.get('tol', 0), params.get('n_iter', '') if params['svd_solver'] == 'randomized' else '',
+              profiler.seconds, svd_time, np.max(np.abs(sigma - reference[2])/reference[2]), subspace_error(train, reference[0]),
+              relative_error(train, reference[0]), relative_error(predicted, reference[1])))
+
+
+def main(number_of_transactions=200000, max_workers=os.cpu_count(), backend='threads'):
+    A, inductive = tripartite_graph(number_of_transactions)
+    # degrees of the graph including the inductive transactions
+    degrees = np.asarray(A.sum(axis=1)).ravel()
+    degrees += np.bincount(inductive.client, minlength=len(degrees)) + np.bincount(inductive.merchant, minlength=len(degrees))
+    workers = [1]
+    while workers[-1]*2 <= max_workers:
+        workers.append(workers[-1]*2)
+    if workers[-1] != max_workers:
+        workers.append(max_workers)
+
+    print('nodes', A.shape[0], 'adjacency entries', A.nnz, 'backend', backend)
+    print('workers  fit (s)  entries/s  predict (s)  rows/s  speedup fit  speedup predict')
+    base = None
+    for n_jobs in workers:
+        model = FIGRL(64, 400, seed=0, svd_solver='dense', n_jobs=n_jobs, backend=backend)
+        start = time.perf_counter()
+        model.fit(A)
+        fit_time = time.perf_counter() - start
+        start = time.perf_counter()
+        model.predict(degrees, inductive, [inductive.client, inductive.merchant], A.shape[0], inductive.index)
+        predict_time = time.perf_counter() - start
+        base = base or (fit_time, predict_time)
+        print('%7d  %7.2f  %9.0f  %11.2f  %6.0f  %11.2f  %15.2f' % (n_jobs, fit_time, A.nnz/fit_time, predict_time,
+              len(inductive)/predict_time, base[0]/fit_time, base[1]/predict_time))
+    print()
+    solver_sweep(A, degrees, inductive, max_workers, backend)
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]), *sys.argv[3:4])
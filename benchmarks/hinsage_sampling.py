@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Neighbour sampling benchmark for HinSAGE.
+
+Builds a synthetic tripartite transaction graph as a StellarGraph and reports the number of
+sampled nodes per second of StellarGraph's HinSAGENodeGenerator and of the FastHinSAGENodeGenerator
+(neighbour tables), both for the sampling alone and including the feature lookup that
+sample_features does for every batch.
+
+Usage: python benchmarks/hinsage_sampling.py [number of transactions] [batch size]
+
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from inductiveGRL.graphconstruction import CSRGraphConstruction, NodeFeatures
+from inductiveGRL.hinsage import FastHinSAGENodeGenerator
+from stellargraph.mapper import HinSAGENodeGenerator
+
+NUM_SAMPLES = [2, 32]
+
+
+def transaction_graph(number_of_transactions, seed=0):
+    rng = np.random.default_rng(seed)
+    clients = rng.zipf(1.5, number_of_transactions) % max(1, number_of_transactions//10)
+    merchants = 10**9 + rng.zipf(1.5, number_of_transactions) % max(1, number_of_transactions//100)
+    transactions = 2*10**9 + np.arange(number_of_transactions)
+    features = {'transaction': pd.DataFrame(rng.random((number_of_transactions, 16)), index=transactions),
+                'client': NodeFeatures([1]), 'merchant': NodeFeatures([1])}
+    graph = CSRGraphConstruction({'client': clients, 'merchant': merchants, 'transaction': transactions},
+                                 [(clients, transactions), (merchants, transactions)], features)
+    return graph.get_stellargraph(), transactions
+
+
+def throughput(function, batches):
+    start = time.perf_counter()
+    sampled = sum(function(batch) for batch in batches)
+    return sampled / (time.perf_counter() - start)
+
+
+def main(number_of_transactions=100000, batch_size=50, number_of_batches=200):
+    S, transactions = transaction_graph(number_of_transactions)
+    rng = np.random.default_rng(1)
+    batches = [S.node_ids_to_ilocs(rng.choice(transactions, batch_size)) for _ in range(number_of_batches)]
+
+    start = time.perf_counter()
+    fast = FastHinSAGENodeGenerator(S, batch_size, NUM_SAMPLES, head_node_type='transaction', seed=0)
+    print('neighbour tables built in %.2fs' % (time.perf_counter() - start))
+    slow = HinSAGENodeGenerator(S, batch_size, NUM_SAMPLES, head_node_type='transaction', seed=0)
+
+    def sample_slow(batch):
+        return sum(len(slot) for walk in slow.sampler.run(nodes=batch, n=1, n_size=NUM_SAMPLES) for slot in walk)
+
+    def sample_fast(batch):
+        return sum(slot.size for slot in fast.tables.sample_tree(batch, fast._type_adjacency, fast.schema.schema, NUM_SAMPLES, fast._rng))
+
+    def features(generator):
+        return lambda batch: sum(np.prod(a.shape[:2]) for a in generator.sample_features(batch, 0))
+
+    print('sampled nodes/s            HinSAGENodeGenerator  FastHinSAGENodeGenerator  speedup')
+    for name, slow_function, fast_function in (('sampling', sample_slow, sample_fast),
+                                               ('sampling + features', features(slow), features(fast))):
+        before, after = throughput(slow_function, batches), throughput(fast_function, batches)
+        print('%-25s  %20.0f  %24.0f  %7.1f' % (name, before, after, after/before))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
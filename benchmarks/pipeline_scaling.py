@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmark for the entry points of the inductive pipeline on synthetic transaction data.
+
+Generates a bipartite client-merchant transaction dataset with power-law client and merchant degrees,
+a 0.65% fraud rate concentrated on compromised clients and risky merchants, an amount and a categorical
+feature and timestamps over a number of days, and times and memory-profiles every public entry point
+(Timeframes, GraphConstruction, CSRGraphConstruction, FIGRL, HinSAGE, Evaluation, EmbeddingStore) for
+an increasing number of transactions. Entry points whose dependencies are not installed are recorded as
+skipped. The results (seconds, peak traced memory and the per-stage report of inductiveGRL.instrumentation
+per size and entry point) are saved as JSON, so that runs of different versions can be compared.
+
+Usage: python benchmarks/pipeline_scaling.py [--sizes 10000 100000 1000000 10000000] [--output results.json] [--no-memory]
+       python benchmarks/pipeline_scaling.py --compare old.json new.json
+
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Demo'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from inductiveGRL.instrumentation import Profiler, stage
+
+FRAUD_RATE = 0.0065
+NUM_SAMPLES = [2, 32]
+
+
+def power_law_choice(rng, number_of_items, size, exponent):
+    # item i is drawn with probability proportional to (i + 1)^-exponent; the ids are shuffled so popular items are spread out
+    weights = np.arange(1, number_of_items + 1, dtype=np.float64)**-exponent
+    cumulative = np.cumsum(weights)
+    draws = np.searchsorted(cumulative, rng.random(size)*cumulative[-1])
+    return rng.permutation(number_of_items)[draws]
+
+
+def synthetic_transactions(number_of_transactions, days=60, categories=100, seed=0):
+
+    """
+    This function returns a dataframe of synthetic transactions in chronological order, indexed by transaction node id,
+    with the columns client_node, merchant_node, timestamp, amount, category and fraud_label.
+    Clients, merchants and transactions have disjoint integer node ids, as in the demo data.
+
+    """
+    rng = np.random.default_rng(seed)
+    clients, merchants = max(1, number_of_transactions//10), max(1, number_of_transactions//100)
+    client = power_law_choice(rng, clients, number_of_transactions, 0.8)
+    merchant = power_law_choice(rng, merchants, number_of_transactions, 1.1)
+    compromised = rng.random(clients) < 0.02
+    risky = rng.random(merchants) < 0.05
+    risk = 1 + 20*compromised[client] + 5*risky[merchant]
+    fraud = rng.random(number_of_transactions) < np.minimum(FRAUD_RATE*risk/risk.mean(), 1)
+    seconds = np.sort(rng.integers(0, days*24*3600, number_of_transactions))
+    return pd.DataFrame({'client_node': client,
+                         'merchant_node': clients + merchant,
+                         'timestamp': np.datetime64('2020-01-01') + seconds.astype('timedelta64[s]'),
+                         'amount': rng.lognormal(4 + fraud, 1.5).astype(np.float32),
+                         'category': rng.integers(0, categories, number_of_transactions).astype(np.int16),
+                         'fraud_label': fraud.astype(np.int8)},
+                        index=pd.Index(clients + merchants + np.arange(number_of_transactions), name='transaction'))
+
+
+def adjacency(data, number_of_nodes):
+    rows = np.concatenate((data.client_node, data.merchant_node, data.index, data.index))
+    cols = np.concatenate((data.index, data.index, data.client_node, data.merchant_node))
+    A = scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(number_of_nodes, number_of_nodes))
+    A.data[:] = 1
+    return A
+
+
+def run(entry, function, memory):
+    # Runs one entry point as a stage of its own under a Profiler; missing optional dependencies are recorded as skipped.
+    try:
+        with Profiler(memory=memory) as profiler, stage(entry):
+            function()
+    except ImportError as error:
+        return {'entry': entry, 'status': 'skipped', 'reason': str(error)}
+    stages = profiler.report()['stages']
+    total = next(s for s in stages if s['stage'] == entry and s['parent'] is None)
+    return {'entry': entry, 'status': 'ok', 'seconds': total['seconds'], 'peak_memory': total['peak_memory'],
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'stages': [s for s in stages if s is not total]}
+
+
+def entry_points(data, args):
+
+    """
+    This function yields (name, function) for every entry point benchmarked on the given transactions; the functions
+    import their modules themselves, so that a missing dependency only skips the entry points that need it.
+
+    """
+    hold_out = data.timestamp >= data.timestamp.iloc[-1] - pd.Timedelta(days=3)
+    train, inductive = data[~hold_out], data[hold_out]
+    number_of_nodes = int(data.index.max()) + 1
+    nodes = {'client': train.client_node, 'merchant': train.merchant_node, 'transaction': train.index}
+    edges = [(train.client_node, train.index), (train.merchant_node, train.index)]
+
+    def timeframes():
+        from inductiveGRL.timeframes import Timeframes
+        frames = Timeframes(data[['timestamp']], step_size=5, window_size=17)
+        sum(len(train_index) + len(inductive_index) for _, train_index, inductive_index in frames.iter_timeframes(3))
+    yield 'Timeframes', timeframes
+
+    if len(train) <= args.max_networkx:
+        def graph_construction():
+            from inductiveGRL.graphconstruction import GraphConstruction
+            GraphConstruction(nodes, [zip(source, target) for source, target in edges]).get_edge_array()
+        yield 'GraphConstruction', graph_construction
+
+    def csr_graph_construction():
+        from inductiveGRL.graphconstruction import CSRGraphConstruction
+        graph = CSRGraphConstruction(nodes, edges)
+        graph.adjacency
+        graph.append({'client': inductive.client_node, 'merchant': inductive.merchant_node, 'transaction': inductive.index}, [(inductive.client_node, inductive.index), (inductive.merchant_node, inductive.index)])
+        graph.get_neighbourhood(graph.get_node_ids(inductive.index[:1000]), len(NUM_SAMPLES))
+    yield 'CSRGraphConstruction', csr_graph_construction
+
+    A = adjacency(train, number_of_nodes)
+    model = {}
+    if len(train) <= args.max_in_memory:
+        def figrl_fit():
+            from FIGRL import FIGRL
+            model['figrl'] = FIGRL(args.embedding_size, args.intermediate_dimension, seed=0, svd_solver='dense', n_jobs=args.jobs)
+            model['figrl'].fit(A)
+        yield 'FIGRL.fit', figrl_fit
+
+    def figrl_fit_out_of_core():
+        from FIGRL import FIGRL
+        edges = np.column_stack((np.concatenate((train.client_node, train.merchant_node)), np.concatenate((train.index, train.index))))
+        figrl = FIGRL(args.embedding_size, args.intermediate_dimension, seed=0, n_jobs=args.jobs)
+        with tempfile.TemporaryDirectory() as directory:
+            embeddings = figrl.fit_out_of_core(edges, number_of_nodes=number_of_nodes, directory=directory)
+            del embeddings
+        model.setdefault('figrl', figrl)
+    yield 'FIGRL.fit_out_of_core', figrl_fit_out_of_core
+
+    def figrl_predict():
+        if 'figrl' not in model:
+            raise ImportError("FIGRL could not be fitted")
+        degrees = np.asarray(adjacency(data, number_of_nodes).sum(axis=1)).ravel()
+        model['figrl'].predict(degrees, inductive, [inductive.client_node, inductive.merchant_node], number_of_nodes - 1, inductive.index)
+    yield 'FIGRL.predict', figrl_predict
+
+    if len(data) <= args.max_hinsage:
+        def hinsage():
+            from inductiveGRL.graphconstruction import CSRGraphConstruction, NodeFeatures
+            from inductiveGRL.hinsage import HinSAGE_Representation_Learner
+            features = {'transaction': NodeFeatures(pd.DataFrame({'amount': np.log1p(data.amount)}, index=data.index)),
+                        'client': NodeFeatures([1]), 'merchant': NodeFeatures([1])}
+            graph = CSRGraphConstruction({'client': data.client_node, 'merchant': data.merchant_node, 'transaction': data.index},
+                                         [(data.client_node, data.index), (data.merchant_node, data.index)], features)
+            S = graph.get_stellargraph()
+            learner = HinSAGE_Representation_Learner(args.embedding_size, NUM_SAMPLES, 'transaction', fast_sampling=True)
+            trained_model, _ = learner.train_hinsage(S, list(train.index), train.fraud_label, batch_size=1000, epochs=1)
+            learner.inductive_step_hinsage(S, trained_model, list(inductive.index), batch_size=1000)
+            learner.inductive_step_hinsage_full(graph, inductive.index)
+        yield 'HinSAGE', hinsage
+
+    def evaluation():
+        from inductiveGRL.evaluation import Evaluation
+        rng = np.random.default_rng(1)
+        score = 1/(1 + np.exp(-(rng.normal(size=len(data)) + 3*data.fraud_label.to_numpy() - 4)))
+        Evaluation(np.column_stack((1 - score, score)), data.fraud_label, 'synthetic').report(np.linspace(0.005, 0.1, 20))
+    yield 'Evaluation', evaluation
+
+    def embedding_store():
+        from inductiveGRL.embeddingstore import EmbeddingStore
+        rng = np.random.default_rng(2)
+        with tempfile.TemporaryDirectory() as directory:
+            store = EmbeddingStore(directory, dimension=args.embedding_size)
+            for start in range(0, len(data), 2**20):
+                ids = data.index[start:start + 2**20]
+                store.put(ids, rng.random((len(ids), args.embedding_size), dtype=np.float32))
+            for _ in range(100):
+                store.get(rng.choice(data.index, 1000))
+    yield 'EmbeddingStore', embedding_store
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__, 'scipy': scipy.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'commit': commit}
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = {(r['size'], r['entry']): r for r in json.load(f)['results'] if r['status'] == 'ok'}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    print('%10s  %-22s  %9s  %9s  %6s  %9s' % ('size', 'entry', 'old (s)', 'new (s)', 'ratio', 'memory'))
+    for result in new:
+        before = old.get((result['size'], result['entry']))
+        if result['status'] != 'ok' or before is None:
+            continue
+        memory = (result['peak_memory'] / before['peak_memory']) if result['peak_memory'] and before['peak_memory'] else float('nan')
+        ratio = result['seconds'] / before['seconds']
+        print('%10d  %-22s  %9.2f  %9.2f  %6.2f  %9.2f%s' % (result['size'], result['entry'], before['seconds'], result['seconds'],
+              ratio, memory, '  slower' if ratio > 1.1 else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10**4, 10**5, 10**6, 10**7])
+    parser.add_argument('--output', default='pipeline_scaling.json')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='do not trace peak memory (faster)')
+    parser.add_argument('--embedding-size', type=int, default=32)
+    parser.add_argument('--intermediate-dimension', type=int, default=128)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--max-networkx', type=int, default=10**6, help='largest size for the networkX GraphConstruction')
+    parser.add_argument('--max-in-memory', type=int, default=10**6, help='largest size for the in-memory FIGRL.fit')
+    parser.add_argument('--max-hinsage', type=int, default=10**5, help='largest size for HinSAGE training')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = []
+    for size in args.sizes:
+        start = time.perf_counter()
+        data = synthetic_transactions(size)
+        print('%d transactions generated in %.1fs (fraud rate %.4f)' % (size, time.perf_counter() - start, data.fraud_label.mean()))
+        for entry, function in entry_points(data, args):
+            result = dict(run(entry, function, args.memory), size=size)
+            results.append(result)
+            if result['status'] == 'ok':
+                print('%10d  %-22s  %9.2fs  peak %s' % (size, entry, result['seconds'],
+                      '%.0f MB' % (result['peak_memory']/2**20) if result['peak_memory'] else '-'))
+            else:
+                print('%10d  %-22s  skipped (%s)' % (size, entry, result['reason']))
+            with open(args.output, 'w') as f:
+                json.dump({'environment': environment(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
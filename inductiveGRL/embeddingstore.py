@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 14 14:05:48 2026
+
+@author: Charles
+
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+class _SortedIndex:
+
+    """
+    An append-only mapping from int64 ids to rows, kept as a few sorted segments whose sizes decrease geometrically
+    (the last two segments are merged whenever the older one is less than twice as large), so a lookup does
+    O(log n) binary searches and adding an id costs amortized O(log n).
+
+    """
+
+    def __init__(self, keys, rows):
+        self._segments = []
+        self.append(keys, rows)
+
+    def get_rows(self, ids):
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        for keys, values in self._segments:
+            positions = np.minimum(np.searchsorted(keys, ids), len(keys) - 1)
+            found = keys[positions] == ids
+            rows[found] = values[positions[found]]
+        return rows
+
+    def append(self, keys, rows):
+        if len(keys) == 0:
+            return
+        order = np.argsort(keys, kind='stable')
+        self._segments.append((keys[order], rows[order]))
+        while len(self._segments) > 1 and len(self._segments[-2][0]) < 2*len(self._segments[-1][0]):
+            (keys, rows), (last_keys, last_rows) = self._segments[-2], self._segments.pop()
+            positions = np.searchsorted(keys, last_keys)
+            self._segments[-1] = (np.insert(keys, positions, last_keys), np.insert(rows, positions, last_rows))
+
+
+class EmbeddingStore:
+
+    """
+    This class persists node (transaction) embeddings in a directory, so they are computed once and looked up
+    by id in later runs and timeframes instead of being recomputed and merged as dataframes.
+    The embeddings are kept as one contiguous float32 array (embeddings.f32), memory-mapped and grown
+    geometrically, with the ids of its rows in an append-only int64 file (ids.i64). The id to row index holds
+    sorted copies of the ids with their rows (16 bytes per id) in a few segments that are merged geometrically,
+    searched with binary search, so appending embeddings does not rebuild the index.
+    Recently read rows are kept in a bounded least-recently-used cache.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the store; created if it does not exist, opened otherwise.
+    dimension : int, optional
+        The embedding size; taken from the first embeddings that are stored if None.
+    cache_size : int
+        The maximum number of rows in the in-memory cache; 0 disables it.
+    read_only : bool
+        If True the store is opened for lookups only.
+
+    """
+
+    def __init__(self, directory, dimension=None, cache_size=2**16, read_only=False):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        config = os.path.join(directory, 'store.json')
+        if os.path.exists(config):
+            with open(config) as f:
+                stored = json.load(f)['dimension']
+            if dimension is not None and dimension != stored:
+                raise ValueError("the store has embeddings of size %d, not %d." % (stored, dimension))
+            dimension = stored
+        elif read_only:
+            raise FileNotFoundError("no embedding store in %s." % directory)
+        self.dimension = dimension
+        path = os.path.join(directory, 'ids.i64')
+        self._row_ids = np.fromfile(path, dtype='<i8') if os.path.exists(path) else np.zeros(0, dtype=np.int64)
+        self._size = len(self._row_ids)
+        self._index = _SortedIndex(self._row_ids, np.arange(self._size))
+        self._data = None
+        self._capacity = 0
+        if dimension is not None:
+            self.__open(self._size)
+
+    def __open(self, capacity):
+        # (Re)map the embeddings file with room for at least capacity rows.
+        path = os.path.join(self.directory, 'embeddings.f32')
+        if not os.path.exists(path):
+            with open(os.path.join(self.directory, 'store.json'), 'w') as f:
+                json.dump({'dimension': self.dimension}, f)
+            open(path, 'wb').close()
+        size = os.path.getsize(path) // (4*self.dimension)
+        if size < capacity:
+            size = max(capacity, 2*size, 1024)
+            with open(path, 'r+b') as f:
+                f.truncate(size*4*self.dimension)
+        self._data = np.memmap(path, dtype='<f4', mode='r' if self.read_only else 'r+', shape=(size, self.dimension))
+        self._capacity = size
+        self._slots = np.full(size, -1, dtype=np.int32)
+        self._cache = np.zeros((self.cache_size, self.dimension), dtype=np.float32)
+        self._cache_rows = np.full(self.cache_size, -1, dtype=np.int64)
+        self._last_used = np.full(self.cache_size, -1, dtype=np.int64)
+        self._tick = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def ids(self):
+        return self._row_ids[:self._size]
+
+    def get_rows(self, ids):
+
+        """
+        This function returns the row of every id in the embeddings array, or -1 for ids that are not in the store.
+
+        Parameters
+        ----------
+        ids : array-like of int
+            The (transaction) ids.
+
+        """
+        return self._index.get_rows(np.asarray(ids, dtype=np.int64))
+
+    def contains(self, ids):
+        return self.get_rows(ids) >= 0
+
+    def put(self, ids, embeddings):
+
+        """
+        This function stores embeddings: new ids are appended, the rows of ids already in the store are overwritten.
+        If an id occurs more than once, its last embedding is kept.
+
+        Parameters
+        ----------
+        ids : array-like of int
+            The (transaction) ids.
+        embeddings : ndarray or Dataframe, shape (len(ids), dimension)
+            The embeddings.
+
+        """
+        if self.read_only:
+            raise ValueError("the embedding store is opened read-only.")
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        if self.dimension is None:
+            self.dimension = embeddings.shape[1]
+            self.__open(0)
+        if embeddings.shape[1] != self.dimension:
+            raise ValueError("the store has embeddings of size %d, not %d." % (self.dimension, embeddings.shape[1]))
+        # keep the last occurrence of every id
+        ids, last = np.unique(ids[::-1], return_index=True)
+        embeddings = embeddings[::-1][last]
+
+        rows = self.get_rows(ids)
+        new = rows < 0
+        rows[new] = self._size + np.arange(np.sum(new))
+        if self._size + np.sum(new) > self._capacity:
+            self._data.flush()
+            self.__open(self._size + np.sum(new))
+        else:
+            # cached copies of overwritten rows are dropped
+            slots = self._slots[rows[~new]]
+            slots = slots[slots >= 0]
+            self._slots[self._cache_rows[slots]] = -1
+            self._cache_rows[slots] = -1
+            self._last_used[slots] = -1
+        self._data[rows] = embeddings
+        self._data.flush()
+
+        # The ids are written after their embeddings, so the rows listed in ids.i64 are always complete.
+        with open(os.path.join(self.directory, 'ids.i64'), 'ab') as f:
+            ids[new].astype('<i8').tofile(f)
+        end = self._size + len(ids[new])
+        if end > len(self._row_ids):
+            row_ids = np.empty(max(end, 2*len(self._row_ids)), dtype=np.int64)
+            row_ids[:self._size] = self._row_ids[:self._size]
+            self._row_ids = row_ids
+        self._row_ids[self._size:end] = ids[new]
+        self._size = end
+        self._index.append(ids[new], rows[new])
+
+    def get(self, ids):
+
+        """
+        This function returns the embeddings of the given ids as a float32 array of shape (len(ids), dimension).
+        It raises a KeyError if an id is not in the store.
+
+        Parameters
+        ----------
+        ids : array-like of int
+            The (transaction) ids.
+
+        """
+        rows = self.get_rows(ids)
+        if (rows < 0).any():
+            raise KeyError("%d ids are not in the embedding store." % np.sum(rows < 0))
+        if len(rows) == 0:
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+        if self.cache_size == 0:
+            return np.asarray(self._data[rows])
+        self._tick += 1
+        embeddings = np.empty((len(rows), self.dimension), dtype=np.float32)
+        slots = self._slots[rows]
+        hit = slots >= 0
+        embeddings[hit] = self._cache[slots[hit]]
+        self._last_used[slots[hit]] = self._tick
+
+        # Missing rows are read in file order, and (up to cache_size of) them replace the least recently used cache rows.
+        missing, inverse = np.unique(rows[~hit], return_inverse=True)
+        values = np.asarray(self._data[missing])
+        embeddings[~hit] = values[inverse.ravel()]
+        k = min(len(missing), self.cache_size - len(np.unique(slots[hit])))
+        if k > 0:
+            free = np.argpartition(self._last_used, k - 1)[:k]
+            old = self._cache_rows[free]
+            self._slots[old[old >= 0]] = -1
+            self._cache[free] = values[-k:]
+            self._cache_rows[free] = missing[-k:]
+            self._last_used[free] = self._tick
+            self._slots[missing[-k:]] = free
+        return embeddings
+
+    def get_frame(self, ids):
+
+        """
+        This function returns the embeddings of the given ids as a pandas dataframe indexed by the ids,
+        as the learners return them.
+
+        Parameters
+        ----------
+        ids : array-like of int
+            The (transaction) ids.
+
+        """
+        return pd.DataFrame(self.get(ids), index=ids)
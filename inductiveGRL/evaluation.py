@@ -8,10 +8,10 @@ Created on Wed Jun 10 15:07:24 2020
 
 import numpy as np
 import pandas as pd
-import scikitplot
 from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import average_precision_score
-from matplotlib import pyplot
+
+# scikitplot and matplotlib are only imported when a plot is drawn, so that evaluation runs headless without them.
 
 class Evaluation:
 
@@ -34,6 +34,47 @@ class Evaluation:
         self.labels = labels
         self.name = name
         
+    def lift_scores(self, percentiles, verbose=False):
+
+        """
+        This function calculates the lift scores for an array of percentiles with one partial sort of the probabilities.
+        It returns a pandas dataframe indexed by percentile with, per percentile, the number of records in the top slice,
+        the number of positives (label 1) in it, its precision and its lift: the precision divided by the fraction of positives
+        in all records. The lift of a top slice without positives is 0; it is NaN for an empty slice or if there are no positives.
+
+        Parameters
+        ----------
+        percentiles : float or array-like of float
+            Specifies the percentiles (fractions between 0 and 1) for which the Lift score should be calculated
+        verbose : bool
+            If True, the lift scores are printed as well.
+
+        """
+        percentiles = np.atleast_1d(np.asarray(percentiles, dtype=np.float64))
+        if np.any((percentiles < 0) | (percentiles > 1)):
+            raise ValueError("percentiles should lie between 0 and 1.")
+        probabilities = np.asarray(self.probabilities)[:, 1]
+        positive = np.asarray(self.labels).ravel() == 1
+        n = len(probabilities)
+        records = np.round(n*percentiles).astype(np.int64)
+
+        # Only the top max(records) probabilities are sorted, after selecting them with argpartition.
+        k = int(records.max()) if len(records) else 0
+        top = np.argpartition(-probabilities, k - 1)[:k] if k < n else np.arange(n)
+        top = top[np.argsort(-probabilities[top], kind='stable')]
+        cumulative = np.concatenate(([0], np.cumsum(positive[top])))
+        positives = cumulative[records]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(records > 0, positives/np.maximum(records, 1), np.nan)
+            lift = precision/(positive.sum()/n) if positive.any() else np.full(len(records), np.nan)
+        scores = pd.DataFrame({'records': records, 'positives': positives, 'precision': precision, 'lift': lift},
+                              index=pd.Index(percentiles, name='percentile'))
+        if verbose:
+            for percentile, lift_score in zip(percentiles, lift):
+                print('The ', percentile*100, "% Lift is equal to: ", lift_score)
+        return scores
+
     def lift_score(self, percentile):
      
         """
@@ -46,24 +87,68 @@ class Evaluation:
             Specifies the percentile for which the Lift score should be calculated
          
         """       
-        prob_class_1 = list(self.probabilities[:,1])
-        prob_class_1_with_labels = np.column_stack((prob_class_1, self.labels))
-        sorted_df = pd.DataFrame(prob_class_1_with_labels).sort_values(by=[0], ascending=[False]).head(round((len(prob_class_1_with_labels)*percentile)))
-        percent_class_1_with_model = (sorted_df[1].value_counts()[1]/(sorted_df[1].value_counts()[0]+sorted_df[1].value_counts()[1]))
-        percent_without_model = (self.labels.value_counts()[1]/(self.labels.value_counts()[0]+self.labels.value_counts()[1]))
-        lift_score = percent_class_1_with_model/percent_without_model
-  
-        print('The ', percentile*100, "% Lift is equal to: ", lift_score)
-      
-        return lift_score
+        return self.lift_scores([percentile], verbose=True)['lift'].iloc[0]
         
-    def lift_curve(self):
+    def pr_points(self):
+
+        """
+        This function returns the points of the precision recall curve: a dictionary of the precision and recall arrays
+        and the thresholds (probabilities of class 1) at which they are reached, as sklearn's precision_recall_curve.
+
+        """
+        precision, recall, thresholds = precision_recall_curve(self.labels, np.asarray(self.probabilities)[:, 1])
+        return {'precision': precision, 'recall': recall, 'thresholds': thresholds}
+
+    def average_precision(self):
+
+        """
+        This function returns the average precision (the area under the precision recall curve) of the classification model.
+
+        """
+        return average_precision_score(self.labels, np.asarray(self.probabilities)[:, 1])
+
+    def report(self, percentiles=(0.01, 0.05, 0.1), curve=True, records=False):
+
+        """
+        This function computes the evaluation without plotting: the average precision, the lift table of lift_scores
+        and the points of the precision recall curve. It returns them in a dictionary.
+
+        Parameters
+        ----------
+        percentiles : array-like of float
+            The percentiles of the lift table.
+        curve : bool
+            If False, the precision recall curve is left out of the report.
+        records : bool
+            If True, arrays and the lift table are converted to lists and lists of records, so that the report can be serialised to JSON.
+
+        """
+        labels = np.asarray(self.labels).ravel()
+        report = {'name': self.name, 'records': len(labels), 'positives': int(np.sum(labels == 1)),
+                  'average_precision': float(self.average_precision()), 'lift': self.lift_scores(percentiles)}
+        if curve:
+            report['pr_curve'] = self.pr_points()
+        if records:
+            report['lift'] = report['lift'].reset_index().to_dict('records')
+            if curve:
+                report['pr_curve'] = {key: values.tolist() for key, values in report['pr_curve'].items()}
+        return report
+
+    def lift_curve(self, show=True):
         """
         This function plots the Lift curve.
         
+        Parameters
+        ----------
+        show : bool
+            If True, the plot is shown with pyplot.show().
+
         """
+        import scikitplot
+        from matplotlib import pyplot
         scikitplot.metrics.plot_lift_curve(self.labels, self.probabilities)
-        pyplot.show()
+        if show:
+            pyplot.show()
         
         
 
@@ -74,11 +159,11 @@ class Evaluation:
         This function plots the precision recall curve for the used classification model and a majority classifier.
         
         """
-        probs = self.probabilities[:, 1]
-        precision, recall, _ = precision_recall_curve(self.labels, probs)
+        from matplotlib import pyplot
+        points = self.pr_points()
         #no_skill = (self.labels.value_counts()[1]/(self.labels.value_counts()[0]+self.labels.value_counts()[1]))
         #pyplot.plot([0, 1], [no_skill, no_skill], linestyle='--', label='Majority classifier')
-        pyplot.plot(recall, precision, label=self.name)
+        pyplot.plot(points['recall'], points['precision'], label=self.name)
         # axis labels
         pyplot.xlabel('Recall')
         pyplot.ylabel('Precision')
@@ -86,4 +171,209 @@ class Evaluation:
         pyplot.legend()
         # show the plot
         
-        print('Average precision-recall score XGBoost: {0:0.10f}'.format(average_precision_score(self.labels, probs)))
+        print('Average precision-recall score XGBoost: {0:0.10f}'.format(self.average_precision()))
+
+
+class StreamingEvaluation:
+
+    """
+    This class evaluates a classification model on predictions that arrive in chunks (e.g. read from files), in memory that
+    does not grow with the number of predictions: the probabilities of class 1 are counted in a histogram of equal-width bins,
+    per label. The metrics are computed from the histogram, treating the probabilities within a bin as ties:
+
+    - the precision recall curve is exact at the bin edges, which are its thresholds;
+    - the lift of a top slice that ends within a bin assumes that the bin's positives are spread evenly over the bin,
+      with lower and upper bounds for the cases in which they are ranked last or first within the bin;
+    - the average precision is the expected average precision over random rankings within every bin, with lower and
+      upper bounds for the worst and best ranking within every bin, so the exact average precision of the unbinned
+      probabilities, and the estimate, lie between them.
+    The bounds narrow as the number of bins increases; with few records per bin they are tight.
+
+    Parameters
+    ----------
+    name : str
+        The name of the used configuration
+    bins : int
+        The number of histogram bins over [0, 1]; memory is 16 bytes per bin.
+
+    """
+
+    def __init__(self, name, bins=2**16):
+        self.name = name
+        self.bins = bins
+        self.positives = np.zeros(bins, dtype=np.int64)
+        self.negatives = np.zeros(bins, dtype=np.int64)
+
+    def update(self, probabilities, labels):
+
+        """
+        This function adds a chunk of predictions to the histograms and returns the evaluator.
+
+        Parameters
+        ----------
+        probabilities : array-like
+            The predicted probabilities per class (as for Evaluation) or only those of class 1.
+        labels : iterable
+            The labels corresponding with the predicted probabilities.
+
+        """
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        if probabilities.ndim == 2:
+            probabilities = probabilities[:, 1]
+        positive = np.asarray(labels).ravel() == 1
+        if len(positive) != len(probabilities):
+            raise ValueError("the chunk has %d probabilities but %d labels." % (len(probabilities), len(positive)))
+        bins = np.clip((probabilities*self.bins).astype(np.int64), 0, self.bins - 1)
+        self.positives += np.bincount(bins[positive], minlength=self.bins)
+        self.negatives += np.bincount(bins[~positive], minlength=self.bins)
+        return self
+
+    def extend(self, chunks):
+
+        """
+        This function adds all (probabilities, labels) chunks of an iterable, e.g. a generator, and returns the evaluator.
+
+        """
+        for probabilities, labels in chunks:
+            self.update(probabilities, labels)
+        return self
+
+    def merge(self, other):
+
+        """
+        This function adds the histograms of another StreamingEvaluation with the same number of bins, e.g. of another worker,
+        and returns the evaluator.
+
+        """
+        if other.bins != self.bins:
+            raise ValueError("cannot merge evaluations with %d and %d bins." % (self.bins, other.bins))
+        self.positives += other.positives
+        self.negatives += other.negatives
+        return self
+
+    def __len__(self):
+        return int(self.positives.sum() + self.negatives.sum())
+
+    def __cumulative(self):
+        # counts of the records in the bins at or above every bin, from the highest bin down
+        return np.cumsum(self.positives[::-1])[::-1], np.cumsum(self.negatives[::-1])[::-1]
+
+    def pr_points(self):
+
+        """
+        This function returns the points of the precision recall curve at the lower edges of the non-empty bins, as a dictionary
+        of the precision and recall arrays and the thresholds, ordered as by sklearn's precision_recall_curve.
+
+        """
+        true_positives, false_positives = self.__cumulative()
+        edges = np.flatnonzero(self.positives + self.negatives)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = true_positives[edges]/(true_positives[edges] + false_positives[edges])
+            recall = true_positives[edges]/true_positives[0]
+        # like sklearn, the curve ends at the point (recall 0, precision 1)
+        return {'precision': np.append(precision, 1.0), 'recall': np.append(recall, 0.0), 'thresholds': edges/self.bins}
+
+    def average_precision(self):
+
+        """
+        This function returns the average precision with its bounds, as a tuple (estimate, lower, upper).
+        The estimate is the expected average precision when the records within every bin are in random order;
+        the bounds rank the positives of every bin after or before its negatives.
+
+        """
+        from scipy.special import digamma
+        total = self.positives.sum()
+        if total == 0:
+            return np.nan, np.nan, np.nan
+        true_positives, false_positives = self.__cumulative()
+        nonempty = self.positives > 0
+        positives, negatives = self.positives[nonempty], self.negatives[nonempty]
+        # records above every bin
+        above = true_positives[nonempty] - positives
+        ranked = above + false_positives[nonempty] - negatives
+
+        def precision_sum(before):
+            # sum over j = 1..p of (above + j)/(before + j): the precisions at the bin's positives after `before` records
+            return positives - (before - above)*(digamma(before + positives + 1) - digamma(before + 1))
+
+        # In a random order of the m records of a bin, the record at position t is positive with probability p/m and then has
+        # (t - 1)(p - 1)/(m - 1) positives of the bin before it in expectation; as the precision at t is linear in that count,
+        # the expected precision sum is p/m * sum over t = 1..m of (above + 1 + (t - 1)c)/(ranked + t), with c = (p - 1)/(m - 1).
+        records = positives + negatives
+        c = (positives - 1)/np.maximum(records - 1, 1)
+        harmonic = digamma(ranked + records + 1) - digamma(ranked + 1)
+        estimate = np.sum(positives/records*((above + 1 - c*(ranked + 1))*harmonic + c*records))
+        lower = np.sum(precision_sum(ranked + negatives))
+        upper = np.sum(precision_sum(ranked))
+        # the estimate lies between the bounds, up to rounding
+        lower, upper = lower/total, upper/total
+        return min(max(estimate/total, lower), upper), lower, upper
+
+    def lift_scores(self, percentiles, verbose=False):
+
+        """
+        This function calculates the lift scores for an array of percentiles, as Evaluation.lift_scores, with the bounds
+        lift_lower and lift_upper for the top slices that end within a bin (the positives column is then an estimate).
+
+        Parameters
+        ----------
+        percentiles : float or array-like of float
+            Specifies the percentiles (fractions between 0 and 1) for which the Lift score should be calculated
+        verbose : bool
+            If True, the lift scores are printed as well.
+
+        """
+        percentiles = np.atleast_1d(np.asarray(percentiles, dtype=np.float64))
+        if np.any((percentiles < 0) | (percentiles > 1)):
+            raise ValueError("percentiles should lie between 0 and 1.")
+        true_positives, false_positives = self.__cumulative()
+        n, total = len(self), self.positives.sum()
+        records = np.round(n*percentiles).astype(np.int64)
+
+        # the bin in which every top slice ends, and the records of the slice within it
+        counts = np.append(true_positives + false_positives, 0)
+        last = np.clip(np.searchsorted(-counts, -records, side='left') - 1, 0, self.bins - 1)
+        above = records - counts[last + 1]
+        in_bin = self.positives[last] + self.negatives[last]
+        positives_above = np.append(true_positives, 0)[last + 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            positives = positives_above + np.where(in_bin > 0, above*self.positives[last]/np.maximum(in_bin, 1), 0)
+            lower = positives_above + np.maximum(0, above - self.negatives[last])
+            upper = positives_above + np.minimum(above, self.positives[last])
+            precision, precision_lower, precision_upper = [np.where(records > 0, p/np.maximum(records, 1), np.nan) for p in (positives, lower, upper)]
+            rate = total/n if total > 0 else np.nan
+        scores = pd.DataFrame({'records': records, 'positives': positives, 'precision': precision, 'lift': precision/rate,
+                               'lift_lower': precision_lower/rate, 'lift_upper': precision_upper/rate},
+                              index=pd.Index(percentiles, name='percentile'))
+        if verbose:
+            for percentile, lift_score in zip(percentiles, scores['lift']):
+                print('The ', percentile*100, "% Lift is equal to: ", lift_score)
+        return scores
+
+    def report(self, percentiles=(0.01, 0.05, 0.1), curve=True, records=False):
+
+        """
+        This function computes the evaluation as Evaluation.report, with the bounds of the average precision
+        and of the lift scores.
+
+        Parameters
+        ----------
+        percentiles : array-like of float
+            The percentiles of the lift table.
+        curve : bool
+            If False, the precision recall curve is left out of the report.
+        records : bool
+            If True, arrays and the lift table are converted to lists and lists of records, so that the report can be serialised to JSON.
+
+        """
+        estimate, lower, upper = self.average_precision()
+        report = {'name': self.name, 'records': len(self), 'positives': int(self.positives.sum()), 'bins': self.bins,
+                  'average_precision': float(estimate), 'average_precision_bounds': (float(lower), float(upper)),
+                  'lift': self.lift_scores(percentiles)}
+        if curve:
+            report['pr_curve'] = self.pr_points()
+        if records:
+            report['lift'] = report['lift'].reset_index().to_dict('records')
+            if curve:
+                report['pr_curve'] = {key: values.tolist() for key, values in report['pr_curve'].items()}
+        return report
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 14:16:08 2026
+
+@author: Charles
+
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+class FeatureAssembler:
+
+    """
+    This class assembles the input of the classifier: the embeddings of the nodes (e.g. of train_hinsage or FIGRL) next to
+    selected raw feature columns of their transactions, written once into a preallocated contiguous float32 matrix.
+    The feature rows are looked up by position (one vectorized index lookup, or none if the embeddings and the data
+    are in the same order), so no merged or dropped intermediate dataframes are created:
+
+        assembler = FeatureAssembler(drop=['fraud_label'])
+        X_train, y_train = assembler.transform(train_emb, train_data, label='fraud_label')
+        X_inductive = assembler.transform(inductive_emb, inductive_data)
+
+    The columns are fixed by the first transform, so the train and inductive matrices have the same columns.
+
+    Parameters
+    ----------
+    columns : list of str, optional
+        The raw feature columns; all numeric and boolean columns of the data that are not dropped if None.
+    drop : list of str, optional
+        Columns that are left out, e.g. the label and timestamp.
+    dtype : numpy dtype
+        The dtype of the matrix.
+
+    """
+
+    def __init__(self, columns=None, drop=None, dtype=np.float32):
+        self.columns = None if columns is None else list(columns)
+        self.drop = set() if drop is None else set(drop)
+        self.dtype = dtype
+        self.embedding_size = None
+
+    chunk_size = 2**16
+
+    @property
+    def feature_names(self):
+        if self.embedding_size is None:
+            return None
+        return ['embedding_%d' % i for i in range(self.embedding_size)] + [str(c) for c in self.columns]
+
+    def __select(self, data):
+        if self.columns is None:
+            self.columns = [c for c in data.columns if c not in self.drop and data[c].dtype.kind in 'biuf']
+        not_numeric = [c for c in self.columns if data[c].dtype.kind not in 'biuf']
+        if not_numeric:
+            raise ValueError("the feature columns %s are not numeric." % not_numeric)
+        return self.columns
+
+    def transform(self, embeddings, data, label=None, index=None, out=None):
+
+        """
+        This function returns the feature matrix, of shape (number of nodes, embedding size + number of columns),
+        with a row per node in the order of the embeddings, and, if label is given, the aligned labels as well.
+
+        Parameters
+        ----------
+        embeddings : pandas Dataframe, ndarray or None
+            The embeddings, indexed by node id; an ndarray has the rows of index. If None, the matrix only has the raw features.
+        data : pandas Dataframe
+            The transaction data, indexed by node id; only the selected columns are read.
+        label : str, optional
+            The label column, returned as an array aligned with the rows of the matrix.
+        index : array-like, optional
+            The node ids of the rows: required for ndarray embeddings, the embedding or data index by default.
+        out : ndarray, optional
+            A C-contiguous matrix of the right shape and dtype to write into, e.g. a memory-mapped array.
+
+        """
+        columns = self.__select(data)
+        if isinstance(embeddings, pd.DataFrame):
+            index = embeddings.index if index is None else index
+            embeddings = embeddings.to_numpy()
+        elif embeddings is not None:
+            embeddings = np.asarray(embeddings)
+            if index is None:
+                raise ValueError("the node ids (index) of ndarray embeddings are required.")
+        else:
+            embeddings = np.zeros((len(data) if index is None else len(index), 0), dtype=self.dtype)
+        index = data.index if index is None else pd.Index(index)
+        if len(index) != len(embeddings):
+            raise ValueError("there are %d embeddings but %d node ids." % (len(embeddings), len(index)))
+        if self.embedding_size is None:
+            self.embedding_size = embeddings.shape[1]
+        elif embeddings.shape[1] != self.embedding_size:
+            raise ValueError("the embeddings have size %d, not %d." % (embeddings.shape[1], self.embedding_size))
+
+        # positions of the rows in the data; None if they are already in the same order
+        if index.equals(data.index):
+            positions = None
+        else:
+            positions = data.index.get_indexer(index)
+            if (positions < 0).any():
+                raise KeyError("%d node ids are not in the data." % np.sum(positions < 0))
+
+        shape = (len(index), self.embedding_size + len(columns))
+        if out is None:
+            out = np.empty(shape, dtype=self.dtype)
+        elif out.shape != shape or out.dtype != self.dtype or not out.flags.c_contiguous:
+            raise ValueError("out should be a C-contiguous %s matrix of shape %s." % (np.dtype(self.dtype), shape))
+        out[:, :self.embedding_size] = embeddings
+        # Consecutive columns of one dtype are read as one (n, k) array, usually a view of the dataframe's block, and their
+        # rows are gathered and written in chunks of rows, so the temporary arrays hold at most chunk_size rows.
+        start = self.embedding_size
+        for _, run in itertools.groupby(columns, key=lambda c: data[c].dtype):
+            run = list(run)
+            values = data[run].to_numpy()
+            for first in range(0, len(index), self.chunk_size):
+                rows = slice(first, first + self.chunk_size)
+                out[rows, start:start + len(run)] = values[rows] if positions is None else values[positions[rows]]
+            start += len(run)
+        if label is None:
+            return out
+        labels = data[label].to_numpy()
+        return out, labels if positions is None else labels[positions]
+
+    def dmatrix(self, embeddings, data, label=None, index=None, **kwargs):
+
+        """
+        This function returns the feature matrix as an XGBoost DMatrix with the feature names and, if label is given, the labels.
+        Its arguments are those of transform; keyword arguments are passed to DMatrix.
+
+        """
+        from xgboost import DMatrix
+        if label is None:
+            return DMatrix(self.transform(embeddings, data, index=index), feature_names=self.feature_names, **kwargs)
+        X, y = self.transform(embeddings, data, label=label, index=index)
+        return DMatrix(X, label=y, feature_names=self.feature_names, **kwargs)
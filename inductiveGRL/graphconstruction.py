@@ -5,8 +5,174 @@ Created on Wed Jun 10 10:01:50 2020
 @author: Charles
 
 """
+import itertools
 import networkx as nx
+import numpy as np
+import pandas as pd
 import stellargraph as sg
+from scipy import sparse
+from inductiveGRL.instrumentation import stage
+
+
+def save_edge_array(edges, path):
+
+    """
+    This function writes an int64 edge array of shape (number of edges, 2) to a binary file that can be memory-mapped.
+    A path ending in .npy is written in numpy format (np.load(path, mmap_mode='r')); any other path gets the raw
+    little-endian int64 values in row order, readable with np.memmap(path, dtype='<i8').reshape(-1, 2) or
+    FIGRL.load_edges in Matlab.
+
+    Parameters
+    ----------
+    edges : ndarray, shape (number of edges, 2)
+        The edge array.
+    path : str
+        The file to write.
+
+    """
+    edges = np.ascontiguousarray(edges, dtype='<i8').reshape(-1, 2)
+    if str(path).endswith('.npy'):
+        np.save(path, edges)
+    else:
+        edges.tofile(path)
+
+class NodeFeatures:
+
+    """
+    This class holds the feature rows of the nodes of one node type in a compact form: a dense array of any dtype
+    (e.g. int8 one-hot indicators or float32 values), a scipy sparse matrix, or a single constant row shared by all
+    nodes of the type, which needs no per-node storage. It can be used wherever the graph constructions accept
+    a feature dataframe. The rows are only expanded to dense float32, the dtype StellarGraph stores features in,
+    when a StellarGraph or a batch of features is requested, so the embeddings are the same as with dataframes.
+
+    Parameters
+    ----------
+    values : ndarray, scipy sparse matrix or Dataframe
+        The feature rows, or a single row (1-dimensional) shared by all nodes if index is None.
+        The values of a dataframe are stored with their common dtype, and its index is used if index is None.
+    index : iterable, optional
+        The node labels of the rows.
+
+    """
+
+    def __init__(self, values, index = None):
+        if isinstance(values, pd.DataFrame):
+            index = values.index if index is None else index
+            values = values.to_numpy()
+        if sparse.issparse(values):
+            values = sparse.csr_matrix(values)
+        else:
+            values = np.asarray(values)
+        if index is None and values.ndim != 1:
+            raise ValueError("values should be a single feature row if no index is given.")
+        if index is not None and values.shape[0] != len(index):
+            raise ValueError("values and index should have the same number of rows.")
+        self.values = values
+        self.index = None if index is None else pd.Index(index)
+
+    @classmethod
+    def from_categories(cls, codes, sizes = None, index = None, dtype = np.int8):
+
+        """
+        This function one-hot encodes categorical features into a sparse matrix with one 1 per column and row.
+
+        Parameters
+        ----------
+        codes : Dataframe or ndarray
+            The category index (0 to size - 1, or -1 if missing) per row for every categorical column.
+        sizes : list of int, optional
+            The number of categories per column; the largest code plus one if None.
+        index : iterable, optional
+            The node labels of the rows; the index of a codes dataframe if None.
+        dtype : dtype
+            The dtype of the stored indicators.
+
+        """
+        if isinstance(codes, pd.DataFrame):
+            index = codes.index if index is None else index
+            codes = codes.to_numpy()
+        codes = np.asarray(codes, dtype=np.int64).reshape(len(codes), -1)
+        sizes = codes.max(axis=0, initial=-1) + 1 if sizes is None else np.asarray(sizes)
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        rows, columns = np.nonzero(codes >= 0)
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype=dtype), (rows, codes[rows, columns] + offsets[columns])), shape=(len(codes), int(np.sum(sizes))))
+        return cls(matrix, index)
+
+    @property
+    def is_constant(self):
+        return self.index is None
+
+    @property
+    def size(self):
+        return self.values.shape[-1]
+
+    @property
+    def shape(self):
+        return (len(self), self.size)
+
+    def __len__(self):
+        return 0 if self.is_constant else len(self.index)
+
+    def get_indexer(self, labels):
+        # the row of every label, or -1 if the label has no features; constant features have a row for every label
+        if self.is_constant:
+            return np.zeros(len(labels), dtype=np.int64)
+        return self.index.get_indexer(labels)
+
+    def take(self, positions, dtype = np.float32):
+        if self.is_constant:
+            return np.tile(self.values.astype(dtype), (len(positions), 1))
+        rows = self.values[positions]
+        return np.asarray(rows.toarray() if sparse.issparse(rows) else rows, dtype=dtype).reshape(len(positions), self.size)
+
+    def get(self, labels, dtype = np.float32):
+
+        """
+        This function returns the feature rows of the given node labels as a dense array.
+
+        Parameters
+        ----------
+        labels : iterable
+            The node labels.
+        dtype : dtype
+            The dtype of the returned array.
+
+        """
+        positions = self.get_indexer(labels)
+        if (positions < 0).any():
+            raise KeyError("no features for %d nodes." % np.sum(positions < 0))
+        return self.take(positions, dtype)
+
+    def append(self, other):
+
+        """
+        This function returns the features with the rows of other appended.
+
+        Parameters
+        ----------
+        other : NodeFeatures
+            The features of the new nodes.
+
+        """
+        if self.is_constant or other.is_constant:
+            if not (self.is_constant and other.is_constant and np.array_equal(self.values, other.values)):
+                raise ValueError("constant features can only be appended to the same constant features.")
+            return self
+        if sparse.issparse(self.values) or sparse.issparse(other.values):
+            values = sparse.vstack((self.values, other.values), format='csr')
+        else:
+            values = np.concatenate((self.values, other.values))
+        return NodeFeatures(values, self.index.append(other.index))
+
+    def to_frame(self, labels = None, dtype = np.float32):
+
+        """
+        This function returns the features as a dense dataframe, for the given node labels (required for constant features).
+
+        """
+        labels = self.index if labels is None else labels
+        return pd.DataFrame(self.get(labels, dtype), index=labels)
+
 
 class GraphConstruction:
     
@@ -20,9 +186,9 @@ class GraphConstruction:
         an iterable container of nodes (list, dict, set etc.)
     edges : 2-tuples (u,v) or 3-tuples (u,v,d)
         Each edge given in the container will be added to the graph. 
-    features: dict(str, (str/dict/list/Dataframe)
+    features: dict(str, (str/dict/list/Dataframe/NodeFeatures)
         A dictionary with keys representing node type, values representing the node
-        data.      
+        data. NodeFeatures keep sparse, compact-dtype or constant features compact until get_stellargraph.
     
     """
     
@@ -31,8 +197,10 @@ class GraphConstruction:
     
     def __init__(self, nodes, edges, features = None):
         self.g_nx = nx.Graph()
-        self.add_nodes(nodes)
-        self.add_edges(edges)
+        with stage('graph build') as timing:
+            self.add_nodes(nodes)
+            self.add_edges(edges)
+            timing.add(nodes=self.g_nx.number_of_nodes(), edges=self.g_nx.number_of_edges())
         
         if features is not None:
             self.node_features = features
@@ -46,17 +214,437 @@ class GraphConstruction:
         
         for edge in edges:
             self.g_nx.add_edges_from(edge)
+
+    def append(self, nodes, edges, features = None):
+
+        """
+        This function appends nodes, edges and node features (new rows per node type) to the graph.
+
+        """
+        self.add_nodes(nodes)
+        self.add_edges(edges)
+        if features is not None:
+            if self.node_features is None:
+                self.node_features = {}
+            for key, values in features.items():
+                if key not in self.node_features:
+                    self.node_features[key] = values
+                elif isinstance(self.node_features[key], NodeFeatures) or isinstance(values, NodeFeatures):
+                    # NodeFeatures are appended as NodeFeatures, also when mixed with dataframes, so they stay compact
+                    stored, values = [v if isinstance(v, NodeFeatures) else NodeFeatures(pd.DataFrame(v)) for v in (self.node_features[key], values)]
+                    self.node_features[key] = stored.append(values)
+                else:
+                    self.node_features[key] = pd.concat((pd.DataFrame(self.node_features[key]), pd.DataFrame(values)))
             
     def get_stellargraph(self):
-        return sg.StellarGraph(self.g_nx, node_type_name="ntype", node_features=self.node_features)
+        node_features = self.node_features
+        if node_features is not None and any(isinstance(values, NodeFeatures) for values in node_features.values()):
+            node_features = dict(node_features)
+            for key, values in node_features.items():
+                if isinstance(values, NodeFeatures):
+                    labels = values.index if not values.is_constant else [n for n, ntype in self.g_nx.nodes(data="ntype") if ntype == key]
+                    node_features[key] = values.to_frame(labels)
+        return sg.StellarGraph(self.g_nx, node_type_name="ntype", node_features=node_features)
     
     def get_edgelist(self):
-        edgelist = []
-        for edge in nx.generate_edgelist(self.g_nx):
-            edgelist.append(str(edge).strip('{}'))
-        el = []
-        for edge in edgelist:
-            splitted = edge.split()
-            numeric = map(float,splitted)
-            el.append(list(numeric))
-        return el
+        return self.get_edge_array().astype(np.float64).tolist()
+
+    def get_edge_array(self):
+
+        """
+        This function returns the edges as an int64 array of shape (number of edges, 2) holding the (integer) node labels,
+        in networkX edge order.
+
+        """
+        edges = itertools.chain.from_iterable(self.g_nx.edges())
+        return np.fromiter(edges, dtype=np.int64, count=2*self.g_nx.number_of_edges()).reshape(-1, 2)
+
+    def save_edge_array(self, path):
+        save_edge_array(self.get_edge_array(), path)
+
+
+class _ArrayBuffer:
+
+    """
+    An append-only numpy array that grows its capacity geometrically, so that appending
+    k values costs amortized O(k) instead of copying the whole array.
+
+    """
+
+    def __init__(self, dtype):
+        self._data = np.empty(0, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, values):
+        values = np.asarray(values)
+        if values.dtype != self._data.dtype and not np.can_cast(values.dtype, self._data.dtype, casting='same_kind'):
+            self._data = self._data.astype(np.result_type(self._data, values))
+        end = self._size + len(values)
+        if end > len(self._data):
+            data = np.empty(max(end, 2*len(self._data)), dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+        self._data[self._size:end] = values
+        self._size = end
+
+    def view(self):
+        return self._data[:self._size]
+
+
+class _LabelIndex:
+
+    """
+    An append-only mapping from node labels to consecutive integer ids. The labels are kept in
+    a few pandas Index segments whose sizes decrease geometrically (the last two segments are
+    merged whenever the older one is less than twice as large), so a lookup queries O(log n)
+    hash tables and appending a label costs amortized O(log n).
+
+    """
+
+    def __init__(self):
+        self._segments = []
+
+    def __len__(self):
+        return sum(len(index) for index in self._segments)
+
+    def get_indexer(self, labels):
+        ids = np.full(len(labels), -1, dtype=np.int64)
+        offset = 0
+        for index in self._segments:
+            missing = np.flatnonzero(ids < 0)
+            if len(missing) == 0:
+                break
+            found = index.get_indexer(labels[missing])
+            hit = found >= 0
+            ids[missing[hit]] = found[hit] + offset
+            offset += len(index)
+        return ids
+
+    def append(self, labels):
+        self._segments.append(pd.Index(labels))
+        while len(self._segments) > 1 and len(self._segments[-2]) < 2*len(self._segments[-1]):
+            last = self._segments.pop()
+            self._segments[-1] = self._segments[-1].append(last)
+
+
+class CSRGraphConstruction:
+
+    """
+    This class initializes an array-backed graph without building a networkX object.
+    Node labels are mapped to contiguous integer ids in insertion order (the same order
+    nx.convert_node_labels_to_integers uses on a GraphConstruction graph), node types are
+    stored as a compact int8 array and the adjacency is kept as a scipy CSR matrix.
+    New nodes, edges and feature rows can be appended; existing node ids never change, and the
+    adjacency is rebuilt from the compact edge buffers only when it is requested again. Neighbourhood
+    and feature lookups combine the last built adjacency with the edges appended since, so extracting
+    the subgraph around new nodes does not require a rebuild.
+
+     Parameters
+    ----------
+    nodes : dict(str, iterable)
+        A dictionary with keys representing the node type, values representing
+        an array-like container of node labels (pandas Series, Index, ndarray, list).
+    edges : list of 2-tuples (source, target)
+        Each tuple holds two equally long array-likes of node labels (e.g. two dataframe columns).
+        Every pair (source[i], target[i]) is added as an undirected edge.
+    features: dict(str, (Dataframe/NodeFeatures)
+        A dictionary with keys representing node type, values representing the node
+        data. The features are stored as NodeFeatures, keeping the dtype of the given values.
+
+    """
+
+    node_type_names = None
+
+    def __init__(self, nodes, edges, features = None):
+        self.node_type_names = []
+        self._index = _LabelIndex()
+        self._labels = None
+        self._types = _ArrayBuffer(np.int8)
+        self._sources = _ArrayBuffer(np.int64)
+        self._targets = _ArrayBuffer(np.int64)
+        self._adjacency = None
+        self._built_edges = 0
+        self._features = {}
+        self.append(nodes, edges, features)
+
+    def append(self, nodes, edges, features = None):
+
+        """
+        This function appends nodes, edges and node features to the graph.
+        Labels that are already part of the graph keep their id (and, like networkX, take the last type).
+
+        Parameters
+        ----------
+        nodes : dict(str, iterable)
+            The new nodes per node type.
+        edges : list of 2-tuples (source, target)
+            The new edges, referring to old or new node labels.
+        features: dict(str, Dataframe/NodeFeatures)
+            The feature rows of the new nodes per node type.
+
+        """
+        with stage('graph build') as timing:
+            number_of_nodes, number_of_edges = len(self._types), len(self._sources)
+            self._add_nodes(nodes)
+            self._add_edges(edges)
+            timing.add(nodes=len(self._types) - number_of_nodes, edges=len(self._sources) - number_of_edges)
+        if features is not None:
+            for name, values in features.items():
+                chunks = self._features.setdefault(name, [])
+                chunks.append(values if isinstance(values, NodeFeatures) else NodeFeatures(values))
+                # Keep O(log n) chunks: merge the last two while the older one is less than twice as large.
+                while len(chunks) > 1 and len(chunks[-2]) < 2*len(chunks[-1]):
+                    last = chunks.pop()
+                    chunks[-1] = chunks[-1].append(last)
+
+    def _add_nodes(self, nodes):
+
+        for name in nodes.keys():
+            if name not in self.node_type_names:
+                self.node_type_names.append(name)
+        labels = [np.asarray(values) for values in nodes.values()]
+        if not labels:
+            return
+        types = np.concatenate([np.full(len(values), self.node_type_names.index(name), dtype=np.int8) for name, values in zip(nodes.keys(), labels)])
+        labels = np.concatenate(labels)
+
+        ids = self._index.get_indexer(labels)
+        new = ids < 0
+        codes, uniques = pd.factorize(labels[new])
+        offset = len(self._types)
+        ids[new] = codes + offset
+        self._index.append(uniques)
+        if self._labels is None:
+            self._labels = _ArrayBuffer(np.asarray(uniques).dtype)
+        self._labels.append(np.asarray(uniques))
+        self._types.append(np.zeros(len(uniques), dtype=np.int8))
+        # Like networkX, a label that occurs under several node types keeps the last type.
+        self._types.view()[ids] = types
+
+    def _add_edges(self, edges):
+
+        for edge in edges:
+            if isinstance(edge, (tuple, list)):
+                source, target = edge
+            else:
+                # Iterators of (u, v) pairs, as used by GraphConstruction, are materialized once.
+                pairs = np.array(list(edge)).reshape(-1, 2)
+                source, target = pairs[:, 0], pairs[:, 1]
+            self._sources.append(self.get_node_ids(source))
+            self._targets.append(self.get_node_ids(target))
+
+    @property
+    def node_labels(self):
+        return self._labels.view()
+
+    @property
+    def node_types(self):
+        return self._types.view()
+
+    def _build_adjacency(self):
+        n = len(self._types)
+        sources, targets = self._sources.view(), self._targets.view()
+        with stage('adjacency build', nodes=n, edges=len(sources)):
+            data = np.ones(2*len(sources), dtype=np.float64)
+            A = sparse.coo_matrix((data, (np.concatenate((sources, targets)), np.concatenate((targets, sources)))), shape=(n, n)).tocsr()
+            # Duplicate edges collapse into a single unweighted edge, as in nx.Graph.
+            A.data[:] = 1
+        self._adjacency = A
+        self._built_edges = len(sources)
+
+    @property
+    def adjacency(self):
+        if self._adjacency is None or self._adjacency.shape[0] != len(self._types) or self._built_edges != len(self._sources):
+            self._build_adjacency()
+        return self._adjacency
+
+    def _pending_edges(self):
+        # The last built adjacency plus the edges appended since; rebuilt once the pending edges are a sizeable share.
+        pending = len(self._sources) - self._built_edges
+        if self._adjacency is None or pending > max(2**16, self._built_edges//8):
+            self._build_adjacency()
+        return self._adjacency, self._sources.view()[self._built_edges:], self._targets.view()[self._built_edges:]
+
+    @property
+    def node_features(self):
+        if not self._features:
+            return None
+        for name, chunks in self._features.items():
+            while len(chunks) > 1:
+                last = chunks.pop()
+                chunks[-1] = chunks[-1].append(last)
+        return {name: chunks[0] for name, chunks in self._features.items()}
+
+    def get_node_features(self, node_type, labels, dtype = np.float32):
+
+        """
+        This function returns the feature rows of the given nodes of one node type as a dense array, looking them up
+        in the stored feature chunks without concatenating them.
+
+        Parameters
+        ----------
+        node_type : str
+            The node type.
+        labels : iterable
+            The node labels.
+        dtype : dtype
+            The dtype of the returned array.
+
+        """
+        labels = np.asarray(labels)
+        chunks = self._features[node_type]
+        rows = np.zeros((len(labels), chunks[-1].size), dtype=dtype)
+        remaining = np.arange(len(labels))
+        for chunk in reversed(chunks):
+            if len(remaining) == 0:
+                break
+            positions = chunk.get_indexer(labels[remaining])
+            found = positions >= 0
+            rows[remaining[found]] = chunk.take(positions[found], dtype)
+            remaining = remaining[~found]
+        if len(remaining):
+            raise KeyError("no features for %d nodes of type %s." % (len(remaining), node_type))
+        return rows
+
+    def get_neighbours(self, ids):
+
+        """
+        This function returns the sorted unique integer ids of the neighbours of the given node ids.
+        Its cost depends on the degrees of the given nodes, not on the size of the graph.
+
+        Parameters
+        ----------
+        ids : array-like of int
+            The integer node ids.
+
+        """
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        A, sources, targets = self._pending_edges()
+        neighbours = [A[ids[ids < A.shape[0]]].indices.astype(np.int64)]
+        neighbours.append(targets[np.isin(sources, ids)])
+        neighbours.append(sources[np.isin(targets, ids)])
+        return np.unique(np.concatenate(neighbours))
+
+    def get_neighbourhood(self, ids, hops):
+
+        """
+        This function returns the sorted integer ids of all nodes within the given number of hops of the given nodes.
+
+        Parameters
+        ----------
+        ids : array-like of int
+            The integer node ids.
+        hops : int
+            The number of hops, e.g. len(num_samples) of a HinSAGE model.
+
+        """
+        nodes = np.unique(np.asarray(ids, dtype=np.int64))
+        frontier = nodes
+        for _ in range(hops):
+            frontier = np.setdiff1d(self.get_neighbours(frontier), nodes, assume_unique=True)
+            nodes = np.union1d(nodes, frontier)
+        return nodes
+
+    def get_node_ids(self, labels):
+
+        """
+        This function returns the integer node ids for an array-like of node labels.
+
+        Parameters
+        ----------
+        labels : iterable
+            The node labels to translate.
+
+        """
+        ids = self._index.get_indexer(np.asarray(labels))
+        if (ids < 0).any():
+            raise ValueError("edges contain node labels that are not part of the nodes.")
+        return ids
+
+    def get_edge_ids(self, start = 0):
+
+        """
+        This function returns the integer node ids of the sources and targets of the edges in the order they were added,
+        from the start-th edge on, e.g. to process only the edges appended since an earlier call; duplicate edges are kept.
+
+        Parameters
+        ----------
+        start : int
+            The number of edges to skip.
+
+        """
+        return self._sources.view()[start:], self._targets.view()[start:]
+
+    def number_of_nodes(self):
+        return len(self._types)
+
+    def number_of_edges(self):
+        return (self.adjacency.nnz + self.adjacency.diagonal().astype(bool).sum())//2
+
+    def get_degrees(self):
+        return np.diff(self.adjacency.indptr)
+
+    def get_adjacency_matrix(self):
+        return self.adjacency
+
+    def get_edge_array(self, labels = False):
+
+        """
+        This function returns the undirected edges as an int64 array of shape (number of edges, 2)
+        holding integer node ids, every edge listed once with source id <= target id.
+
+        Parameters
+        ----------
+        labels : bool
+            Return the (integer) node labels instead of the node ids, like GraphConstruction.get_edge_array.
+
+        """
+        upper = sparse.triu(self.adjacency, format='coo')
+        edges = np.column_stack((upper.row, upper.col)).astype(np.int64)
+        if labels:
+            edges = self.node_labels[edges].astype(np.int64)
+        return edges
+
+    def save_edge_array(self, path, labels = False):
+        save_edge_array(self.get_edge_array(labels), path)
+
+    def _subgraph_edges(self, ids):
+        # edges with both endpoints in the sorted unique ids, each listed once
+        A, sources, targets = self._pending_edges()
+        rows = A[ids[ids < A.shape[0]]].tocoo()
+        row, col = ids[ids < A.shape[0]][rows.row], rows.col.astype(np.int64)
+        keep = (row <= col) & np.isin(col, ids)
+        new = np.isin(sources, ids) & np.isin(targets, ids)
+        return np.concatenate((row[keep], sources[new])), np.concatenate((col[keep], targets[new]))
+
+    def get_stellargraph(self, node_ids = None):
+
+        """
+        This function returns the graph, or the subgraph induced by the given node ids, as a StellarGraph.
+
+        Parameters
+        ----------
+        node_ids : array-like of int, optional
+            The integer ids of the nodes to keep, e.g. from get_neighbourhood; None keeps the whole graph.
+
+        """
+        if node_ids is None:
+            edges = self.get_edge_array()
+            sources, targets = edges[:, 0], edges[:, 1]
+            ids = np.arange(self.number_of_nodes())
+        else:
+            ids = np.unique(np.asarray(node_ids, dtype=np.int64))
+            sources, targets = self._subgraph_edges(ids)
+        edges = pd.DataFrame({"source": self.node_labels[sources], "target": self.node_labels[targets]})
+        nodes = {}
+        types = self.node_types[ids]
+        for i, name in enumerate(self.node_type_names):
+            labels = self.node_labels[ids[types == i]]
+            if name in self._features:
+                nodes[name] = sg.IndexedArray(self.get_node_features(name, labels), index=labels)
+            else:
+                nodes[name] = pd.DataFrame(index=labels)
+        return sg.StellarGraph(nodes=nodes, edges=edges)
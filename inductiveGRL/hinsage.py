@@ -8,11 +8,177 @@ Created on Wed Jun 10 11:45:24 2020
 
 
 from stellargraph.layer import HinSAGE    
+from stellargraph.layer.hinsage import MeanHinAggregator
 from stellargraph.mapper import HinSAGENodeGenerator, NodeSequence
 from keras import layers
 from tensorflow.keras import layers, optimizers, Model
 from tensorflow.keras.losses import binary_crossentropy
+from tensorflow.keras.callbacks import EarlyStopping
+from tensorflow.keras.utils import Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import time
+import numpy as np
 import pandas as pd
+from inductiveGRL.sampling import NeighbourTables
+from inductiveGRL.inference import HinSAGEInference
+from inductiveGRL.instrumentation import stage
+
+
+class FastHinSAGENodeGenerator(HinSAGENodeGenerator):
+
+    """
+    This class is a drop-in replacement for HinSAGENodeGenerator that samples neighbours from
+    precomputed NeighbourTables, drawing all samples of a batch with vectorized numpy operations.
+    The samples have the layout HinSAGENodeGenerator produces, so the generator can be used
+    to build, train and apply the same HinSAGE models.
+    
+    Parameters
+    ----------
+    G, batch_size, num_samples, head_node_type, schema, seed, name :
+        As for HinSAGENodeGenerator.
+    tables : NeighbourTables, optional
+        Precomputed neighbour tables of G; built from G and the schema if None.
+    
+    """
+
+    def __init__(self, G, batch_size, num_samples, head_node_type=None, schema=None, seed=None, name=None, tables=None):
+        super().__init__(G, batch_size, num_samples, head_node_type=head_node_type, schema=schema, seed=seed, name=name)
+        self.tables = NeighbourTables.from_stellargraph(G, self.schema) if tables is None else tables
+        self._type_adjacency = self.schema.type_adjacency_list(self.head_node_types, len(self.num_samples))
+        self._rng = np.random.default_rng(seed)
+
+    def sample_features(self, head_nodes, batch_num):
+        with stage('sampling', nodes=len(head_nodes)):
+            slots = self.tables.sample_tree(head_nodes, self._type_adjacency, self.schema.schema, self.num_samples, self._rng)
+            batch_feats = []
+            for (node_type, _), ilocs in zip(self._type_adjacency, slots):
+                # ilocs of -1 (no neighbour) get zero features from StellarGraph
+                features = self.graph.node_features(ilocs.ravel(), node_type, use_ilocs=True)
+                batch_feats.append(np.reshape(features, (len(head_nodes), ilocs.shape[1], features.shape[1])))
+        return batch_feats
+
+
+_worker_sample_function = None
+
+def _initialize_worker(sample_function):
+    # Every worker process unpickles the sample function (and its graph) once, and draws its own random samples.
+    global _worker_sample_function
+    _worker_sample_function = sample_function
+    generator = getattr(sample_function, '__self__', None)
+    seed = np.random.SeedSequence([os.getpid(), time.time_ns()])
+    if hasattr(generator, '_rng'):
+        generator._rng = np.random.default_rng(seed)
+    sampler = getattr(generator, 'sampler', None)
+    if hasattr(sampler, '_random_state') and hasattr(sampler, '_np_random_state'):
+        sampler._random_state.seed(int(seed.generate_state(1)[0]))
+        sampler._np_random_state.seed(seed.generate_state(1))
+
+def _sample_batch(sample_function, head_ids, batch_num):
+    start = time.perf_counter()
+    batch_feats = (sample_function or _worker_sample_function)(head_ids, batch_num)
+    return batch_feats, time.perf_counter() - start
+
+
+class PrefetchingSequence(Sequence):
+
+    """
+    This class wraps the NodeSequence of a HinSAGE node generator's flow, so that the neighbourhoods of the next
+    batches are sampled by background workers while the model processes the current batch.
+    It also measures the throughput of the pipeline, see report.
+    
+    Parameters
+    ----------
+    sequence : NodeSequence
+        The sequence returned by the flow method of a HinSAGE node generator.
+    workers : int
+        The number of sampler workers.
+    queue_depth : int
+        The number of batches sampled ahead of the batch the model requests.
+    backend : str
+        'threads' or 'processes'. Processes avoid the GIL for StellarGraph's pure Python sampler, but every worker
+        holds a copy of the graph and draws its own random samples.
+    
+    """
+
+    def __init__(self, sequence, workers=1, queue_depth=10, backend='threads'):
+        if backend not in ('threads', 'processes'):
+            raise ValueError("backend should be 'threads' or 'processes'.")
+        self.sequence = sequence
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.backend = backend
+        self.executor = None
+        self.pending = {}
+        self.batches = 0
+        self.sampling_time = 0.0
+        self.waiting_time = 0.0
+        self.start = None
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __submit(self, batch_num):
+        sequence = self.sequence
+        batch_indices = sequence.indices[sequence.batch_size*batch_num:sequence.batch_size*(batch_num+1)]
+        head_ids = [sequence.ids[i] for i in batch_indices]
+        batch_targets = None if sequence.targets is None else sequence.targets[batch_indices]
+        sample_function = sequence._sample_function if self.backend == 'threads' else None
+        self.pending[batch_num] = (self.executor.submit(_sample_batch, sample_function, head_ids, batch_num), batch_targets)
+
+    def __getitem__(self, batch_num):
+        if batch_num >= len(self) or batch_num < 0:
+            raise IndexError("batch %d is out of range." % batch_num)
+        if self.executor is None:
+            if self.backend == 'threads':
+                self.executor = ThreadPoolExecutor(self.workers)
+            else:
+                self.executor = ProcessPoolExecutor(self.workers, initializer=_initialize_worker, initargs=(self.sequence._sample_function,))
+            self.start = time.perf_counter()
+        for i in range(batch_num, min(batch_num + self.queue_depth + 1, len(self))):
+            if i not in self.pending:
+                self.__submit(i)
+        future, batch_targets = self.pending.pop(batch_num)
+        start = time.perf_counter()
+        batch_feats, sampling_time = future.result()
+        self.waiting_time += time.perf_counter() - start
+        self.sampling_time += sampling_time
+        self.batches += 1
+        return batch_feats, batch_targets
+
+    def on_epoch_end(self):
+        # Batches sampled ahead belong to the old order of the nodes, which the sequence reshuffles now.
+        for future, _ in self.pending.values():
+            future.cancel()
+        for future, _ in self.pending.values():
+            if not future.cancelled():
+                future.exception()
+        self.pending = {}
+        self.sequence.on_epoch_end()
+
+    def report(self):
+
+        """
+        This function returns the throughput of the pipeline so far as a dictionary: the number of batches, the seconds
+        since the first batch was requested, batches per second, the fraction of the time the sampler workers were idle
+        and the fraction of the time the model waited for a batch.
+        Many idle workers mean fewer workers suffice; a model that waits while few workers are idle needs more of them.
+        """
+        seconds = time.perf_counter() - self.start if self.start is not None else 0.0
+        return {'batches': self.batches, 'seconds': seconds,
+                'batches_per_second': self.batches / seconds if seconds else 0.0,
+                'sampler_idle': 1 - self.sampling_time / (self.workers * seconds) if seconds else 0.0,
+                'model_waiting': self.waiting_time / seconds if seconds else 0.0}
+
+    def close(self):
+        if self.executor is not None:
+            # cancelled by hand, as shutdown(cancel_futures=True) requires Python 3.9
+            for future, _ in self.pending.values():
+                future.cancel()
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.pending = {}
+
 
 class HinSAGE_Representation_Learner:
     
@@ -28,18 +194,91 @@ class HinSAGE_Representation_Learner:
         define the number of nodes to sample per neighborhood.
     embedding_for_node_type: str
         String identifying the node type for which we want graphsage to generate embeddings.  
+    fast_sampling: bool
+        If True, neighbours are sampled with a FastHinSAGENodeGenerator from precomputed neighbour tables
+        instead of StellarGraph's HinSAGENodeGenerator.
+    workers: int
+        The number of sampler workers that prefetch batches while the model trains or predicts, see PrefetchingSequence.
+        If 0, the batches are sampled when the model requests them.
+    queue_depth: int
+        The number of batches the workers sample ahead.
+    backend: str
+        'threads' or 'processes' for the sampler workers.
+    
+    Attributes
+    ----------
+    throughput : dict
+        The throughput report (see PrefetchingSequence.report) of the last run of every stage:
+        'train', 'validation', 'embeddings' and 'inductive'.
+    model : Model
+        The classification model (HinSAGE and its final estimator layer) last trained by train_hinsage.
+    training_report : dict
+        The epochs run, the maximum number of epochs and the training time of the last call of train_hinsage, whether it
+        was warm-started, the epochs and (estimated) time saved by early stopping versus the maximum number of epochs, and
+        the epochs and (estimated) time saved by the warm start versus a cold start (cold_start_epochs), None if unknown.
+    cold_start_epochs : int
+        The epochs to convergence from random weights, against which the saving of a warm start is reported: set by every
+        train_hinsage call without warm start (e.g. on the first window), or set from a reference run; None if unknown.
     
     """
     
    
-    def __init__(self, embedding_size, num_samples, embedding_for_node_type):
+    def __init__(self, embedding_size, num_samples, embedding_for_node_type, fast_sampling=False, workers=0, queue_depth=10, backend='threads'):
 
         self.embedding_size = embedding_size
         self.num_samples = num_samples
         self.embedding_for_node_type = embedding_for_node_type
+        self.fast_sampling = fast_sampling
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.backend = backend
+        self.throughput = {}
+        self.schema = None
+        self._hinsage = None
+        self._generators = {}
+        self._tables = None
+        self.model = None
+        self.training_report = None
+        self.cold_start_epochs = None
+
+    def _node_generator(self, S, batch_size, schema=None, cache=True):
+        # Generators (and their neighbour tables) are reused for repeated calls on the same graph object.
+        key = (id(S), batch_size)
+        if cache and key in self._generators and self._generators[key][0] is S:
+            return self._generators[key][1]
+        Generator = FastHinSAGENodeGenerator if self.fast_sampling else HinSAGENodeGenerator
+        generator = Generator(S, batch_size, self.num_samples, head_node_type=self.embedding_for_node_type, schema=schema)
+        if cache:
+            self._generators = {key: (S, generator)}
+        return generator
+
+    def _prefetch(self, sequence):
+        if self.workers > 0:
+            return PrefetchingSequence(sequence, workers=self.workers, queue_depth=self.queue_depth, backend=self.backend)
+        return sequence
+
+    def _close(self, **sequences):
+        for stage, sequence in sequences.items():
+            if isinstance(sequence, PrefetchingSequence):
+                self.throughput[stage] = sequence.report()
+                sequence.close()
 
 
-    def train_hinsage(self, S, node_identifiers, label, batch_size, epochs):
+    def _warm_start(self, model, trained_model, warm_start):
+        if warm_start is True:
+            if self.model is None:
+                raise ValueError("train_hinsage must be called before warm-starting from the previous model.")
+            warm_start = self.model
+        weights = warm_start.get_weights() if hasattr(warm_start, 'get_weights') else list(warm_start)
+        # Weights of the classification model include the final estimator layer, those of the returned trained model do not.
+        if len(weights) == len(model.get_weights()):
+            model.set_weights(weights)
+        elif len(weights) == len(trained_model.get_weights()):
+            trained_model.set_weights(weights)
+        else:
+            raise ValueError("the weights to warm-start from do not match the HinSAGE model.")
+
+    def train_hinsage(self, S, node_identifiers, label, batch_size, epochs, warm_start=None, patience=None, store=None):
 
         """
         
@@ -57,7 +296,16 @@ class HinSAGE_Representation_Learner:
         batch_size: int
             batch size to train the neural network in which HinSAGE is implemented.
         epochs: int
-            Number of epochs for the neural network.
+            Number of epochs for the neural network, the maximum number if patience is given.
+        warm_start: bool, Model or list, optional
+            Initial weights instead of random ones, e.g. when retraining on the next, largely overlapping timeframe:
+            True for the model this learner trained last, a model (the trained model returned by train_hinsage or
+            the classification model in learner.model) or a list of weights (model.get_weights()).
+        patience: int, optional
+            If given, training stops once the validation loss has not improved for this many epochs,
+            and the weights of the epoch with the lowest validation loss are kept.
+        store: EmbeddingStore, optional
+            If given, the embeddings of the train nodes are also written to this store.
         
         """
         # The mapper feeds data from sampled subgraph to GraphSAGE model
@@ -65,12 +313,14 @@ class HinSAGE_Representation_Learner:
         train_labels = label.loc[train_node_identifiers]
         validation_node_identifiers = node_identifiers[round(0.8*len(node_identifiers)):]
         validation_labels = label.loc[validation_node_identifiers]
-        generator = HinSAGENodeGenerator(S, batch_size, self.num_samples, head_node_type= self.embedding_for_node_type)
-        train_gen = generator.flow(train_node_identifiers, train_labels, shuffle=True)
-        test_gen = generator.flow(validation_node_identifiers, validation_labels)
+        generator = self._node_generator(S, batch_size)
+        self.schema = generator.schema
+        train_gen = self._prefetch(generator.flow(train_node_identifiers, train_labels, shuffle=True))
+        test_gen = self._prefetch(generator.flow(validation_node_identifiers, validation_labels))
 
         # HinSAGE model
         model = HinSAGE(layer_sizes=[self.embedding_size]*len(self.num_samples), generator=generator, dropout=0)
+        self._hinsage = model
         x_inp, x_out = model.build()
         
         # Final estimator layer
@@ -82,21 +332,51 @@ class HinSAGE_Representation_Learner:
         optimizer=optimizers.Adam(lr=1e-3),
              loss=binary_crossentropy,
             )
+        trained_model = Model(inputs=x_inp, outputs=x_out)
+        if warm_start is not None and warm_start is not False:
+            self._warm_start(model, trained_model, warm_start)
+        callbacks = [] if patience is None else [EarlyStopping(monitor='val_loss', patience=patience, restore_best_weights=True)]
         
         # Train Model
-        model.fit(
-        train_gen, epochs=epochs, verbose=1, validation_data=test_gen, shuffle=False
-        )
+        start = time.perf_counter()
+        try:
+            with stage('training', nodes=len(node_identifiers)) as timing:
+                history = model.fit(
+                train_gen, epochs=epochs, verbose=1, validation_data=test_gen, shuffle=False, callbacks=callbacks
+                )
+                timing.add(epochs=len(history.history['loss']))
+        finally:
+            self._close(train=train_gen, validation=test_gen)
+        seconds = time.perf_counter() - start
+        epochs_run = len(history.history['loss'])
+        seconds_per_epoch = seconds/max(epochs_run, 1)
+        warm = warm_start is not None and warm_start is not False
+        if not warm:
+            self.cold_start_epochs = epochs_run
+        # the saving of the warm start is estimated with the time per epoch of this window, as window sizes differ
+        epochs_saved = None if self.cold_start_epochs is None else self.cold_start_epochs - epochs_run
+        self.model = model
+        self.training_report = {'epochs': epochs_run, 'max_epochs': epochs, 'seconds': seconds, 'warm_start': warm,
+                                'epochs_saved_by_early_stopping': epochs - epochs_run,
+                                'seconds_saved_by_early_stopping': (epochs - epochs_run)*seconds_per_epoch,
+                                'cold_start_epochs': self.cold_start_epochs, 'epochs_saved': epochs_saved,
+                                'seconds_saved': None if epochs_saved is None else epochs_saved*seconds_per_epoch}
  
-        trained_model = Model(inputs=x_inp, outputs=x_out)
-        train_gen_not_shuffled = generator.flow( node_identifiers, label, shuffle=False)
-        embeddings_train = trained_model.predict(train_gen_not_shuffled)
+        train_gen_not_shuffled = self._prefetch(generator.flow( node_identifiers, label, shuffle=False))
+        try:
+            with stage('forward pass', nodes=len(node_identifiers)):
+                embeddings_train = trained_model.predict(train_gen_not_shuffled)
+        finally:
+            self._close(embeddings=train_gen_not_shuffled)
 
-        train_emb = pd.DataFrame(embeddings_train,  index=node_identifiers)
+        with stage('embedding assembly', nodes=len(node_identifiers)):
+            train_emb = pd.DataFrame(embeddings_train,  index=node_identifiers)
+            if store is not None:
+                store.put(node_identifiers, embeddings_train)
     
         return trained_model, train_emb
     
-    def inductive_step_hinsage(self, S, trained_model, inductive_node_identifiers, batch_size):
+    def inductive_step_hinsage(self, S, trained_model, inductive_node_identifiers, batch_size, store=None):
  
         """
         
@@ -113,14 +393,147 @@ class HinSAGE_Representation_Learner:
             Defines the nodes that HinSAGE needs to generate embeddings for
         batch_size: int
             batch size for the neural network in which HinSAGE is implemented.
+        store: EmbeddingStore, optional
+            If given, the embeddings are also written to this store.
 
         """
         
         # The mapper feeds data from sampled subgraph to HinSAGE model
-        generator = HinSAGENodeGenerator(S, batch_size, self.num_samples, head_node_type=self.embedding_for_node_type)
-        test_gen_not_shuffled = generator.flow(inductive_node_identifiers, shuffle=False )
+        generator = self._node_generator(S, batch_size)
+        test_gen_not_shuffled = self._prefetch(generator.flow(inductive_node_identifiers, shuffle=False ))
+    
+        try:
+            with stage('forward pass', nodes=len(inductive_node_identifiers)):
+                inductive_emb = trained_model.predict(test_gen_not_shuffled, verbose=1)
+        finally:
+            self._close(inductive=test_gen_not_shuffled)
+        with stage('embedding assembly', nodes=len(inductive_node_identifiers)):
+            inductive_emb = pd.DataFrame(inductive_emb, index=inductive_node_identifiers)
+            if store is not None:
+                store.put(inductive_node_identifiers, inductive_emb.values)
+    
+        return inductive_emb
+
+    def export_inference(self):
+
+        """
+        
+        This function exports the aggregator weights of the HinSAGE model trained by train_hinsage to a HinSAGEInference,
+        which generates the same embeddings as inductive_step_hinsage with numpy only.
+        The result can be saved with its save method and loaded in workers without TensorFlow or Keras.
+        
+        """
+        
+        if self._hinsage is None:
+            raise ValueError("train_hinsage must be called before exporting the model.")
+        layers = []
+        for aggregators in self._hinsage._aggs:
+            weights = {}
+            for node_type, aggregator in aggregators.items():
+                if not isinstance(aggregator, MeanHinAggregator):
+                    raise ValueError("only mean aggregators can be exported, not %s." % type(aggregator).__name__)
+                weights[node_type] = {'w_self': aggregator.w_self.numpy(),
+                                      'w_neigh': [None if w is None else w.numpy() for w in aggregator.w_neigh],
+                                      'bias': aggregator.bias.numpy() if aggregator.has_bias else None}
+            layers.append(weights)
+        schema = {node_type: [tuple(edge_type) for edge_type in edge_types] for node_type, edge_types in self.schema.schema.items()}
+        return HinSAGEInference(self._hinsage.subtree_schema, schema, self.num_samples, layers, self._hinsage.activations, normalize='l2')
+
+    def inductive_step_hinsage_full(self, graph, inductive_node_identifiers=None, store=None):
+
+        """
+        
+        This function generates embeddings in bulk with the model trained by train_hinsage, computing every layer once for
+        all nodes of the graph with full-neighbourhood means instead of sampling a tree per node (see HinSAGEInference.embed_full).
+        It suits re-scoring all nodes of a window, and returns the embeddings for the given nodes.
+        
+        Parameters
+        ----------
+        graph : CSRGraphConstruction
+            The graph on which HinSAGE is deployed.
+        inductive_node_identifiers : list, optional
+            Defines the nodes that HinSAGE needs to generate embeddings for; all nodes of embedding_for_node_type if None.
+        store: EmbeddingStore, optional
+            If given, the embeddings are also written to this store.
+
+        """
+        
+        inductive_emb = self.export_inference().embed_full(graph, inductive_node_identifiers)
+        if store is not None:
+            store.put(inductive_emb.index, inductive_emb.values)
     
-        inductive_emb = trained_model.predict(test_gen_not_shuffled, verbose=1)
-        inductive_emb = pd.DataFrame(inductive_emb, index=inductive_node_identifiers)
+        return inductive_emb
+
+    def _neighbour_tables(self, graph):
+        # The neighbour tables of a CSRGraphConstruction are cached between calls; edges appended to the graph
+        # since the last call are added to them, so only the new edges are processed.
+        if self._tables is None or self._tables[0] is not graph or self._tables[2] is not self.schema:
+            edge_types = [edge_type for edge_types in self.schema.schema.values() for edge_type in edge_types]
+            tables = NeighbourTables.from_graph_construction(graph, edge_types)
+            self._tables = [graph, len(graph.get_edge_ids()[0]), self.schema, tables]
+        _, seen, _, tables = self._tables
+        sources, targets = graph.get_edge_ids(seen)
+        if len(sources):
+            names = np.array(graph.node_type_names, dtype=object)
+            tables.append(sources, targets, names[graph.node_types[sources]], names[graph.node_types[targets]])
+            self._tables[1] = seen + len(sources)
+        return tables
+
+    def inductive_step_hinsage_subgraph(self, graph, trained_model, inductive_node_identifiers, batch_size, store=None, seed=None):
+
+        """
+        
+        This function generates embeddings for unseen nodes using a trained hinsage model, like inductive_step_hinsage,
+        but samples the HinSAGE neighbourhoods directly from the CSR neighbour tables of the graph and only looks up the
+        features of the sampled nodes, instead of building a StellarGraph. The samples follow the same distribution as
+        those of the node generator on the full graph, while the cost of a batch scales with the batch size and the
+        number of samples instead of the size of the graph or the history of the sampled clients and merchants.
+        The neighbour tables are cached between calls, and only the edges appended to the graph since are added to them.
+        
+        Parameters
+        ----------
+        graph : CSRGraphConstruction
+            The graph, including the unseen nodes and their edges, on which HinSAGE is deployed.
+        trained_model : Neural Network
+            The trained hinsage model, containing the trained and optimized aggregation functions per depth.
+        inductive_node_identifiers : list
+            Defines the nodes that HinSAGE needs to generate embeddings for
+        batch_size: int
+            batch size for the neural network in which HinSAGE is implemented.
+        store: EmbeddingStore, optional
+            If given, the embeddings are also written to this store.
+        seed: int, optional
+            The seed of the neighbour sampling.
+
+        """
+        
+        if self.schema is None:
+            raise ValueError("train_hinsage must be called before the subgraph inductive step.")
+        tables = self._neighbour_tables(graph)
+        # The schema of the training graph keeps the sample layout of the trained model.
+        type_adjacency = self.schema.type_adjacency_list([self.embedding_for_node_type], len(self.num_samples))
+        rng = np.random.default_rng(seed)
+        ids = graph.get_node_ids(np.asarray(inductive_node_identifiers))
+        inductive_emb = []
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start+batch_size]
+            with stage('sampling', nodes=len(batch)) as timing:
+                slots = tables.sample_tree(batch, type_adjacency, self.schema.schema, self.num_samples, rng)
+                batch_feats = []
+                for (node_type, _), ilocs in zip(type_adjacency, slots):
+                    # only the features of the sampled nodes are looked up; nodes without neighbours get zero features
+                    sampled, inverse = np.unique(ilocs, return_inverse=True)
+                    found = sampled >= 0
+                    features = graph.get_node_features(node_type, graph.node_labels[sampled[found]])
+                    values = np.zeros((len(sampled), features.shape[1]), dtype=np.float32)
+                    values[found] = features
+                    batch_feats.append(values[inverse.ravel()].reshape(ilocs.shape + (features.shape[1],)))
+                    timing.add(sampled_nodes=int(found.sum()))
+            with stage('forward pass', nodes=len(batch)):
+                inductive_emb.append(np.asarray(trained_model.predict_on_batch(batch_feats)))
+        with stage('embedding assembly', nodes=len(inductive_node_identifiers)):
+            inductive_emb = pd.DataFrame(np.concatenate(inductive_emb) if inductive_emb else None, index=inductive_node_identifiers)
+            if store is not None:
+                store.put(inductive_node_identifiers, inductive_emb.values)
     
         return inductive_emb            
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 13 09:40:12 2026
+
+@author: Charles
+
+"""
+import json
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from inductiveGRL.sampling import NeighbourTables
+from inductiveGRL.instrumentation import stage
+
+ACTIVATIONS = {'relu': lambda x: np.maximum(x, 0), 'linear': lambda x: x}
+
+class HinSAGEInference:
+
+    """
+    This class applies a trained HinSAGE model (mean aggregators) with numpy only, so that scoring
+    workers neither import TensorFlow/Keras nor pay Keras' per-call overhead.
+    It is created with HinSAGE_Representation_Learner.export_inference after training, and can be
+    saved to and loaded from a .npz file.
+    The layers are computed as StellarGraph's HinSAGE does: per layer and node type, a node's output is
+    act([h_self W_self, mean over relations r of (mean of the sampled neighbours of r) W_neigh_r] + bias),
+    and the output of the last layer is L2-normalized.
+
+    Parameters
+    ----------
+    type_adjacency : list of (str, list of int)
+        The sampling tree, as given by GraphSchema.type_adjacency_list.
+    schema : dict(str, list of tuple)
+        The edge types (source type, relation, target type) per node type, in the order of the children in type_adjacency.
+    num_samples : list
+        The number of samples per hop.
+    layers : list of dict(str, dict)
+        Per layer and node type the aggregator weights: 'w_self', 'w_neigh' (a list with None for relations without samples) and 'bias' (or None).
+    activations : list of str
+        The activation per layer, 'relu' or 'linear'.
+    normalize : str
+        'l2' to L2-normalize the embeddings, None otherwise.
+
+    """
+
+    def __init__(self, type_adjacency, schema, num_samples, layers, activations, normalize='l2'):
+        self.type_adjacency = [(node_type, list(children)) for node_type, children in type_adjacency]
+        self.schema = {node_type: [tuple(edge_type) for edge_type in edge_types] for node_type, edge_types in schema.items()}
+        self.num_samples = list(num_samples)
+        self.layers = layers
+        self.activations = list(activations)
+        self.normalize = normalize
+        self.head_node_type = self.type_adjacency[0][0]
+        self.__tables = None
+
+        # The slots that every layer aggregates, and the hop of every slot, as in StellarGraph's HinSAGE.
+        self.neigh_trees = []
+        tree = [slot for slot in self.type_adjacency if len(slot[1]) > 0]
+        while tree:
+            self.neigh_trees.append(tree)
+            tree = [slot for slot in tree if all(child < len(tree) for child in slot[1])]
+        self.depths = [0]*len(self.type_adjacency)
+        for index, (_, children) in enumerate(self.type_adjacency):
+            for child in children:
+                self.depths[child] = self.depths[index] + 1
+
+    def predict(self, batch_feats):
+
+        """
+        This function computes the embeddings of a batch of sampled neighbourhoods.
+        It returns a float32 array of shape (batch size, embedding size).
+
+        Parameters
+        ----------
+        batch_feats : list of ndarray
+            The features of every slot of the sampling tree, of shape (batch size, sampled nodes, features),
+            as returned by the sample_features method of a HinSAGE node generator.
+
+        """
+        h = [np.asarray(x, dtype=np.float32) for x in batch_feats]
+        for layer, tree in enumerate(self.neigh_trees):
+            act = ACTIVATIONS[self.activations[layer]]
+            out = []
+            for index, (node_type, children) in enumerate(tree):
+                weights = self.layers[layer][node_type]
+                head = h[index]
+                batch_size, heads = head.shape[:2]
+                from_neigh = np.zeros((batch_size, heads, weights['w_self'].shape[1]), dtype=np.float32)
+                for child, w_neigh in zip(children, weights['w_neigh']):
+                    if w_neigh is not None:
+                        neighbours = h[child].reshape(batch_size, heads, self.num_samples[self.depths[index]], -1)
+                        from_neigh = from_neigh + neighbours.mean(axis=2) @ w_neigh
+                total = np.concatenate((head @ weights['w_self'], from_neigh / len(children)), axis=2)
+                if weights['bias'] is not None:
+                    total = total + weights['bias']
+                out.append(act(total).astype(np.float32, copy=False))
+            h = out
+        embeddings = h[0].reshape(h[0].shape[0], -1)
+        if self.normalize == 'l2':
+            embeddings = embeddings / np.sqrt(np.maximum(np.sum(embeddings**2, axis=1, keepdims=True), 1e-12))
+        return embeddings
+
+    def sample_features(self, tables, features, rows, head_nodes, rng):
+
+        """
+        This function samples the neighbourhoods of a batch of head nodes and looks up their features,
+        in the layout of a HinSAGE node generator. Nodes without neighbours get zero features.
+
+        Parameters
+        ----------
+        tables : NeighbourTables
+            The neighbour tables of the graph.
+        features : dict(str, ndarray)
+            The feature matrix of every node type.
+        rows : ndarray
+            The row of every node iloc in the feature matrix of its node type.
+        head_nodes : ndarray
+            The head node ilocs.
+        rng : numpy Generator
+            The random generator.
+
+        """
+        slots = tables.sample_tree(head_nodes, self.type_adjacency, self.schema, self.num_samples, rng)
+        batch_feats = []
+        for (node_type, _), ilocs in zip(self.type_adjacency, slots):
+            matrix = features[node_type]
+            index = np.where(ilocs >= 0, rows[np.maximum(ilocs, 0)], -1).ravel()
+            values = np.zeros((len(index), matrix.shape[1]), dtype=np.float32)
+            values[index >= 0] = matrix[index[index >= 0]]
+            batch_feats.append(values.reshape(len(head_nodes), ilocs.shape[1], matrix.shape[1]))
+        return batch_feats
+
+    def embed(self, graph, node_labels, batch_size, seed=None):
+
+        """
+        This function generates the embeddings of nodes of a CSRGraphConstruction, like inductive_step_hinsage.
+        It returns a pandas dataframe with the embeddings, indexed by the node labels.
+        The neighbour tables are cached, and rebuilt when the graph has grown.
+
+        Parameters
+        ----------
+        graph : CSRGraphConstruction
+            The graph, with features for every node type.
+        node_labels : list
+            The labels of the nodes to embed.
+        batch_size: int
+            The number of nodes per batch.
+        seed : int, optional
+            The seed of the neighbour sampling.
+
+        """
+        size = (graph.number_of_nodes(), graph.number_of_edges())
+        if self.__tables is None or self.__tables[0] is not graph or self.__tables[1] != size:
+            edge_types = [edge_type for edge_types in self.schema.values() for edge_type in edge_types]
+            tables = NeighbourTables.from_graph_construction(graph, edge_types)
+            rows = np.zeros(graph.number_of_nodes(), dtype=np.int64)
+            features = {}
+            for i, name in enumerate(graph.node_type_names):
+                ids = np.flatnonzero(graph.node_types == i)
+                rows[ids] = np.arange(len(ids))
+                features[name] = graph.get_node_features(name, graph.node_labels[ids])
+            self.__tables = (graph, size, tables, features, rows)
+        _, _, tables, features, rows = self.__tables
+
+        rng = np.random.default_rng(seed)
+        ids = graph.get_node_ids(np.asarray(node_labels))
+        embeddings = []
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start+batch_size]
+            with stage('sampling', nodes=len(batch)):
+                batch_feats = self.sample_features(tables, features, rows, batch, rng)
+            with stage('forward pass', nodes=len(batch)):
+                embeddings.append(self.predict(batch_feats))
+        return pd.DataFrame(np.concatenate(embeddings) if embeddings else None, index=node_labels)
+
+    def embed_full(self, graph, node_labels=None):
+
+        """
+        This function generates the embeddings of nodes of a CSRGraphConstruction in bulk, computing every HinSAGE layer
+        once for all nodes of a type instead of per sampled tree: the mean over sampled neighbours is replaced by the mean
+        over all neighbours, a sparse product of the row-normalized adjacency between two node types with the previous layer.
+        The cost is O(edges x layers) instead of O(nodes x product of num_samples), which suits re-scoring all nodes of a window.
+        The sampled means of inductive_step_hinsage are unbiased estimates of these full-neighbourhood means, so the
+        embeddings are those HinSAGE converges to for many samples, not the sampled ones.
+        It returns a pandas dataframe with the embeddings, indexed by the node labels.
+
+        Parameters
+        ----------
+        graph : CSRGraphConstruction
+            The graph, with features for every node type.
+        node_labels : list, optional
+            The labels of the nodes to embed, all of the head node type; all nodes of the head node type if None.
+
+        """
+        ids = {name: np.flatnonzero(graph.node_types == i) for i, name in enumerate(graph.node_type_names)}
+        ids = {name: ids.get(name, np.zeros(0, dtype=np.int64)) for name in self.schema}
+        for edge_types in self.schema.values():
+            for edge_type in edge_types:
+                ids.setdefault(edge_type[2], np.zeros(0, dtype=np.int64))
+        A = graph.adjacency
+        means = {}
+
+        def mean(node_type, target_type):
+            # The neighbour means of node_type over target_type are one product with the row-normalized adjacency block.
+            if (node_type, target_type) not in means:
+                block = A[ids[node_type]][:, ids[target_type]].astype(np.float32)
+                degrees = np.asarray(block.sum(axis=1)).ravel()
+                means[node_type, target_type] = sparse.diags(1/np.maximum(degrees, 1)).dot(block).tocsr()
+            return means[node_type, target_type]
+
+        needed = set(self.layers[0])
+        for node_type in self.layers[0]:
+            needed.update(edge_type[2] for edge_type in self.schema[node_type])
+        h = {name: graph.get_node_features(name, graph.node_labels[ids[name]]) for name in needed}
+        with stage('forward pass', nodes=graph.number_of_nodes(), edges=graph.number_of_edges()):
+            for layer, weights in enumerate(self.layers):
+                act = ACTIVATIONS[self.activations[layer]]
+                out = {}
+                for node_type, aggregator in weights.items():
+                    from_neigh = np.zeros((len(ids[node_type]), aggregator['w_self'].shape[1]), dtype=np.float32)
+                    for edge_type, w_neigh in zip(self.schema[node_type], aggregator['w_neigh']):
+                        if w_neigh is not None:
+                            from_neigh += mean(node_type, edge_type[2]).dot(h[edge_type[2]] @ w_neigh)
+                    total = np.concatenate((h[node_type] @ aggregator['w_self'], from_neigh / len(aggregator['w_neigh'])), axis=1)
+                    if aggregator['bias'] is not None:
+                        total = total + aggregator['bias']
+                    out[node_type] = act(total).astype(np.float32, copy=False)
+                h = out
+
+        embeddings = h[self.head_node_type]
+        if self.normalize == 'l2':
+            embeddings = embeddings / np.sqrt(np.maximum(np.sum(embeddings**2, axis=1, keepdims=True), 1e-12))
+        head = ids[self.head_node_type]
+        if node_labels is None:
+            return pd.DataFrame(embeddings, index=graph.node_labels[head])
+        node_ids = graph.get_node_ids(np.asarray(node_labels))
+        positions = np.minimum(np.searchsorted(head, node_ids), max(len(head) - 1, 0))
+        if len(node_ids) and (len(head) == 0 or (head[positions] != node_ids).any()):
+            raise ValueError("node_labels should all be nodes of type %s." % self.head_node_type)
+        return pd.DataFrame(embeddings[positions], index=node_labels)
+
+    def save(self, path):
+
+        """
+        This function saves the model to a .npz file.
+
+        Parameters
+        ----------
+        path : str
+            The file path.
+
+        """
+        arrays = {}
+        for layer, weights in enumerate(self.layers):
+            for node_type, aggregator in weights.items():
+                arrays['%d/%s/w_self' % (layer, node_type)] = aggregator['w_self']
+                for r, w_neigh in enumerate(aggregator['w_neigh']):
+                    if w_neigh is not None:
+                        arrays['%d/%s/w_neigh/%d' % (layer, node_type, r)] = w_neigh
+                if aggregator['bias'] is not None:
+                    arrays['%d/%s/bias' % (layer, node_type)] = aggregator['bias']
+        config = {'type_adjacency': self.type_adjacency, 'schema': self.schema, 'num_samples': self.num_samples,
+                  'activations': self.activations, 'normalize': self.normalize,
+                  'relations': [{node_type: len(aggregator['w_neigh']) for node_type, aggregator in weights.items()} for weights in self.layers]}
+        np.savez(path, config=np.array(json.dumps(config)), **arrays)
+
+    @classmethod
+    def load(cls, path):
+
+        """
+        This function loads a model saved with save.
+
+        Parameters
+        ----------
+        path : str
+            The file path.
+
+        """
+        with np.load(path) as data:
+            config = json.loads(str(data['config']))
+            layers = []
+            for layer, relations in enumerate(config['relations']):
+                weights = {}
+                for node_type, n in relations.items():
+                    prefix = '%d/%s/' % (layer, node_type)
+                    weights[node_type] = {'w_self': data[prefix + 'w_self'],
+                                          'w_neigh': [data[prefix + 'w_neigh/%d' % r] if prefix + 'w_neigh/%d' % r in data else None for r in range(n)],
+                                          'bias': data[prefix + 'bias'] if prefix + 'bias' in data else None}
+                layers.append(weights)
+        return cls(config['type_adjacency'], config['schema'], config['num_samples'], layers, config['activations'], config['normalize'])
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 15 10:22:17 2026
+
+@author: Charles
+
+"""
+import json
+import threading
+import time
+import tracemalloc
+
+_profiler = None
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, **counts):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+def _number(value):
+    # numpy scalars are converted so that the report can be serialised to JSON
+    return value.item() if hasattr(value, 'item') else value
+
+def stage(name, **counts):
+
+    """
+    This function returns a context manager that records one run of a pipeline stage (e.g. 'sketch product') with the
+    active Profiler: its wall time, the given counts (e.g. nodes=..., edges=...) and its peak memory.
+    Without an active Profiler it returns a shared no-op context manager, so instrumented code pays one function call.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage.
+    **counts : int
+        Counts of the work done in the stage; counts only known inside the stage can be added with add(...).
+
+    """
+    if _profiler is None:
+        return _NULL_STAGE
+    return _Stage(_profiler, name, counts)
+
+class _Stage:
+
+    def __init__(self, profiler, name, counts):
+        self.profiler = profiler
+        self.name = name
+        self.counts = {key: _number(value) for key, value in counts.items()}
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + _number(value)
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        self.parent = stack[-1].name if stack else None
+        self.peak = 0
+        if self.profiler.memory:
+            if hasattr(tracemalloc, 'reset_peak'):
+                # The peak of the enclosing stage is saved before the peak is reset for this stage.
+                if stack:
+                    stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.reset_peak()
+            else:
+                # Python < 3.9 cannot reset the peak: the peak counts only if the stage raises it,
+                # otherwise the larger current value at the start or end of the stage is reported.
+                self.peak, self.start_peak = tracemalloc.get_traced_memory()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        stack = self.profiler._stack()
+        stack.pop()
+        if self.profiler.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, 'reset_peak'):
+                self.peak = max(self.peak, peak)
+            else:
+                self.peak = max(self.peak, current, peak if peak > self.start_peak else 0)
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        record = {'stage': self.name, 'parent': self.parent, 'seconds': seconds, 'counts': self.counts,
+                  'peak_memory': self.peak if self.profiler.memory else None}
+        self.profiler._record(record)
+        return False
+
+class Profiler:
+
+    """
+    This class collects timing, throughput and peak memory of the instrumented stages of the inductiveGRL learners
+    (graph build, adjacency normalization, sketch product, SVD, sampling, forward pass, embedding assembly, ...)
+    while it is active, i.e. inside a with block:
+
+        with Profiler() as profiler:
+            model.fit(...)
+        profiler.save('run.json')
+
+    Stages that run repeatedly (e.g. sampling per batch) are aggregated per name in the report; callbacks
+    are called with the record of every single run. Peak memory is that of the whole process (all threads)
+    during the stage, as far as allocations are traced by tracemalloc (numpy arrays are). Before Python 3.9 the peak
+    cannot be reset per stage, so a stage that does not raise the overall peak reports its current memory at its start or end.
+
+    Parameters
+    ----------
+    callbacks : list of callables, optional
+        Functions that are called with the record (a dictionary) of every finished stage run.
+    memory : bool
+        If True, the peak memory allocated in every stage is traced with tracemalloc, which slows down
+        allocation-heavy code; if False only time and counts are recorded.
+
+    """
+
+    def __init__(self, callbacks=None, memory=True):
+        self.callbacks = list(callbacks) if callbacks is not None else []
+        self.memory = memory
+        self.stages = {}
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._tracing = False
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _record(self, record):
+        with self._lock:
+            summary = self.stages.setdefault(record['stage'], {'stage': record['stage'], 'parent': record['parent'], 'calls': 0,
+                                                                 'seconds': 0.0, 'counts': {}, 'peak_memory': None})
+            summary['calls'] += 1
+            summary['seconds'] += record['seconds']
+            for key, value in record['counts'].items():
+                summary['counts'][key] = summary['counts'].get(key, 0) + value
+            if record['peak_memory'] is not None:
+                summary['peak_memory'] = max(summary['peak_memory'] or 0, record['peak_memory'])
+        for callback in self.callbacks:
+            callback(record)
+
+    def __enter__(self):
+        global _profiler
+        if _profiler is not None:
+            raise RuntimeError("another Profiler is already active.")
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        _profiler = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global _profiler
+        self.seconds += time.perf_counter() - self._start
+        _profiler = None
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        return False
+
+    def report(self):
+
+        """
+        This function returns the run report: the total profiled seconds and, per stage in the order the stages first
+        finished, the number of runs, total seconds, summed counts, throughput (counts per second) and peak memory in bytes.
+        The report only contains numbers, strings and None, so it can be serialised to JSON.
+
+        """
+        stages = []
+        with self._lock:
+            for summary in self.stages.values():
+                summary = dict(summary, counts=dict(summary['counts']))
+                summary['throughput'] = {key: value / summary['seconds'] for key, value in summary['counts'].items() if summary['seconds'] > 0}
+                stages.append(summary)
+        return {'seconds': self.seconds, 'stages': stages}
+
+    def save(self, path):
+
+        """
+        This function writes the run report to a JSON file.
+
+        Parameters
+        ----------
+        path : str
+            The file to write.
+
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 09:41:52 2026
+
+@author: Charles
+
+"""
+import collections
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from inductiveGRL.timeframes import Timeframes
+from inductiveGRL.evaluation import Evaluation
+from inductiveGRL.instrumentation import stage
+
+def _key(*parts):
+    # a deterministic hash of the given stage name, function, parameters and upstream key
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+
+def _stage(name, function, params, cache_key=None):
+    # A stage as (name, function, params, cache_key), with cache_key the parameters in the cache key: the params if None.
+    # The cache key must be JSON-serialisable, since a repr (e.g. of an object with a memory address) is not stable across runs.
+    try:
+        _key(params if cache_key is None else cache_key)
+    except (TypeError, ValueError):
+        raise TypeError("the params of stage %r are not JSON-serialisable; pass a JSON-serialisable cache_key as the fourth "
+                        "element of the stage." % name) from None
+    return name, function, params, cache_key
+
+def _fingerprint(index):
+    # a hash of the index labels of a window, so that a changed window invalidates its cached stages
+    values = pd.util.hash_pandas_object(pd.Index(index), index=False).to_numpy()
+    return hashlib.sha1(values.tobytes()).hexdigest()[:16]
+
+def _run_timeframe(timeframe, train_data, inductive_data, stages, window, cache_directory):
+    # Runs the stages of one timeframe, reading and writing the output of every stage from and to the cache.
+    context = {'timeframe': timeframe, 'train_data': train_data, 'inductive_data': inductive_data}
+    key = _key(window, timeframe, _fingerprint(train_data.index), _fingerprint(inductive_data.index))
+    for name, function, params, cache_key in stages:
+        key = _key(name, function.__module__, function.__qualname__, params if cache_key is None else cache_key, key)
+        path = None if cache_directory is None else os.path.join(cache_directory, name, '%d-%s.pkl' % (timeframe, key))
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                context[name] = pickle.load(f)
+            continue
+        with stage(name, timeframe=timeframe):
+            context[name] = function(context, **params)
+        if path is not None:
+            # written under a temporary name first, so an interrupted run never leaves a partial cache file
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(context[name], f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+    results = context[stages[-1][0]]
+    results = results if isinstance(results, pd.DataFrame) else pd.DataFrame([results] if isinstance(results, dict) else list(results))
+    # assign returns a copy, so the output of the stage (which may be cached) is left as it is; a timeframe column is replaced
+    results = results.assign(timeframe=timeframe)
+    results = results[['timeframe'] + [c for c in results.columns if c != 'timeframe']]
+    return results
+
+def evaluate(context, predictions, label, percentiles=(0.01,)):
+
+    """
+    This function is a final stage for TimeframeRunner: it evaluates the predictions of one or more models on the inductive data.
+    It returns one record per model with the average precision and the lift scores at the given percentiles.
+
+    Parameters
+    ----------
+    context : dict
+        The context of the timeframe, as passed to every stage.
+    predictions : str
+        The name of the stage whose output is a dictionary of model name to predicted probabilities per class for the inductive data.
+    label : str
+        The label column of the data.
+    percentiles : iterable of float
+        The percentiles of the lift scores.
+
+    """
+    labels = context['inductive_data'][label]
+    records = []
+    for model, probabilities in context[predictions].items():
+        report = Evaluation(probabilities, labels, model).report(percentiles, curve=False)
+        record = {'model': model, 'records': report['records'], 'positives': report['positives'],
+                  'average_precision': report['average_precision']}
+        record.update(('lift@%g' % percentile, lift) for percentile, lift in report['lift']['lift'].items())
+        records.append(record)
+    return records
+
+class TimeframeRunner:
+
+    """
+    This class runs an experiment, a sequence of stages (e.g. graph construction, HinSAGE, FIGRL, classifier, evaluation),
+    for every rolling window timeframe of the data, with the timeframes in parallel over a pool of processes.
+    Every stage is a function function(context, **params) with context a dictionary holding 'timeframe', 'train_data',
+    'inductive_data' (split as by Timeframes.train_inductive_split) and the outputs of the preceding stages by name:
+
+        def train_hinsage(context, embedding_size, num_samples):
+            ...
+            return train_emb, inductive_emb
+
+        runner = TimeframeRunner(df, 'TX_DATETIME', 5, 17, 5, [('graph', build_graph, {}),
+                                                               ('hinsage', train_hinsage, {'embedding_size': 64, 'num_samples': [2, 32]}),
+                                                               ('classifier', classify, {}),
+                                                               ('evaluation', evaluate, {'predictions': 'classifier', 'label': 'TX_FRAUD'})],
+                                 cache_directory='cache', workers=4)
+        results = runner.run(results_path='results.csv')
+
+    The output of every stage is cached (pickled) per timeframe under a key of the window, the stage's function and parameters
+    and the keys of the preceding stages, so a rerun only runs the stages that are new or whose parameters or inputs changed.
+    The output of the last stage (a dictionary, a list of dictionaries or a dataframe) is the result of the timeframe,
+    with a first column timeframe (which replaces a timeframe column of the output).
+    The params of a stage must be JSON-serialisable, or else the stage must give a JSON-serialisable cache_key that
+    identifies them (e.g. a model name and version for a model object). With a cache directory the outputs of the stages
+    must be picklable, also with one worker; with more than one worker the stage functions and params must be picklable
+    as well, i.e. be defined at module level.
+
+    Parameters
+    ----------
+    data : pandas Dataframe
+        The data of all timeframes.
+    date_column : str
+        The date column of the data.
+    step_size, window_size : int
+        The step size and window size (days) of the timeframes, as for Timeframes.
+    hold_out_days : int
+        The number of days that are held out of the train set of every timeframe.
+    stages : list of 3-tuples (name, function, params) or 4-tuples (name, function, params, cache_key)
+        The stages, run in order; params is a dictionary of keyword arguments of the function, and cache_key, if given,
+        is used in the cache key instead of params.
+    cache_directory : str, optional
+        The directory of the cached stage outputs; nothing is cached if None.
+    workers : int
+        The number of processes; the timeframes are run in this process if 1.
+
+    """
+
+    def __init__(self, data, date_column, step_size, window_size, hold_out_days, stages, cache_directory=None, workers=1):
+        if not stages:
+            raise ValueError("at least one stage is required.")
+        self.data = data
+        self.timeframes = Timeframes(data[[date_column]], step_size=step_size, window_size=window_size)
+        self.window = {'date_column': date_column, 'step_size': step_size, 'window_size': window_size, 'hold_out_days': hold_out_days}
+        self.hold_out_days = hold_out_days
+        self.stages = [_stage(*s) for s in stages]
+        self.cache_directory = cache_directory
+        self.workers = workers
+
+    def __tasks(self, timeframes):
+        for timeframe, train_index, inductive_index in self.timeframes.iter_timeframes(self.hold_out_days):
+            if timeframes is None or timeframe in timeframes:
+                yield (timeframe, self.data.loc[train_index], self.data.loc[inductive_index], self.stages, self.window, self.cache_directory)
+
+    def run(self, timeframes=None, results_path=None):
+
+        """
+        This function runs the stages for every timeframe and returns the consolidated results: a pandas dataframe with
+        the results of all timeframes, in the order of the timeframes, with a timeframe column.
+
+        Parameters
+        ----------
+        timeframes : iterable of int, optional
+            The timeframes to run; all timeframes (1 to get_number_of_timeframes()) if None.
+        results_path : str, optional
+            If given, the results are also written to this CSV file.
+
+        """
+        timeframes = None if timeframes is None else set(timeframes)
+        results = []
+        if self.workers == 1:
+            for task in self.__tasks(timeframes):
+                results.append(_run_timeframe(*task))
+        else:
+            # at most 2*workers windows are sliced and in flight, so memory stays bounded
+            with ProcessPoolExecutor(self.workers) as executor:
+                pending = collections.deque()
+                for task in self.__tasks(timeframes):
+                    pending.append(executor.submit(_run_timeframe, *task))
+                    if len(pending) >= 2*self.workers:
+                        results.append(pending.popleft().result())
+                while pending:
+                    results.append(pending.popleft().result())
+        results = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=['timeframe'])
+        if results_path is not None:
+            results.to_csv(results_path, index=False)
+        return results
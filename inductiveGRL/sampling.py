@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 12 10:12:31 2026
+
+@author: Charles
+
+"""
+import numpy as np
+
+class NeighbourTables:
+
+    """
+    This class stores the neighbours of every node per edge type in compact arrays, so that
+    HinSAGE neighbour samples can be drawn for a whole batch with a few vectorized numpy operations
+    instead of a Python loop per sampled node.
+    For every edge type (source node type, relation, target node type) the neighbours are kept as
+    CSR offsets (int64, one entry per node plus one) and int32 target node ilocs, sorted per node.
+    Only numpy is needed, so the tables can also be used without StellarGraph or TensorFlow.
+
+    Parameters
+    ----------
+    number_of_nodes : int
+        The number of nodes (ilocs run from 0 to number_of_nodes - 1).
+    tables : dict(tuple, (ndarray, ndarray))
+        A dictionary with the edge types (source type, relation, target type) as keys and
+        the (offsets, targets) CSR arrays as values.
+
+    """
+
+    def __init__(self, number_of_nodes, tables):
+        self.number_of_nodes = number_of_nodes
+        self.tables = tables
+        self._pending = {}
+
+    @staticmethod
+    def _pairs(edge_type, sources, targets, source_types, target_types, relations, directed):
+        # the (node, neighbour) pairs of the edges for one edge type
+        source_type, relation, target_type = edge_type
+        match = np.ones(len(sources), dtype=bool) if relations is None else np.asarray(relations) == relation
+        forward = match & (source_types == source_type) & (target_types == target_type)
+        rows, cols = [sources[forward]], [targets[forward]]
+        if not directed:
+            backward = match & (target_types == source_type) & (source_types == target_type) & (sources != targets)
+            rows.append(targets[backward])
+            cols.append(sources[backward])
+        return np.concatenate(rows), np.concatenate(cols)
+
+    @classmethod
+    def from_arrays(cls, node_types, sources, targets, edge_types, relations=None, directed=False):
+
+        """
+        This function builds the tables from edge arrays.
+
+        Parameters
+        ----------
+        node_types : ndarray
+            The node type of every node iloc.
+        sources, targets : ndarray
+            The node ilocs of the edges.
+        edge_types : iterable of (source type, relation, target type) tuples
+            The edge types to build tables for, e.g. the edge types of a StellarGraph schema.
+        relations : ndarray, optional
+            The relation of every edge; if None every edge matches every relation.
+        directed : bool
+            If False, an edge (u, v) also makes u a neighbour of v.
+
+        """
+        node_types = np.asarray(node_types)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        n = len(node_types)
+        source_types, target_types = node_types[sources], node_types[targets]
+        tables = {}
+        for edge_type in edge_types:
+            rows, cols = cls._pairs(edge_type, sources, targets, source_types, target_types, relations, directed)
+            order = np.lexsort((cols, rows))
+            offsets = np.zeros(n+1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=n), out=offsets[1:])
+            tables[tuple(edge_type)] = (offsets, cols[order].astype(np.int32))
+        return cls(n, tables)
+
+    @classmethod
+    def from_stellargraph(cls, G, schema):
+
+        """
+        This function builds the tables for all edge types of a StellarGraph schema.
+
+        Parameters
+        ----------
+        G : StellarGraph Object
+            The graph.
+        schema : GraphSchema
+            The schema of the graph, e.g. the schema of a HinSAGENodeGenerator.
+
+        """
+        node_types = np.empty(G.number_of_nodes(), dtype=object)
+        for node_type in G.node_types:
+            node_types[G.nodes(node_type=node_type, use_ilocs=True)] = node_type
+        sources, targets, relations = G.edge_arrays(include_edge_type=True, use_ilocs=True)
+        edge_types = [edge_type for types in schema.schema.values() for edge_type in types]
+        return cls.from_arrays(node_types, sources, targets, edge_types, relations=relations, directed=G.is_directed())
+
+    @classmethod
+    def from_graph_construction(cls, graph, edge_types):
+
+        """
+        This function builds the tables from a CSRGraphConstruction, whose integer node ids are used as ilocs.
+        Its edges have no relation, so they match the edge types of any relation.
+
+        Parameters
+        ----------
+        graph : CSRGraphConstruction
+            The graph.
+        edge_types : iterable of (source type, relation, target type) tuples
+            The edge types to build tables for.
+
+        """
+        node_types = np.array(graph.node_type_names, dtype=object)[graph.node_types]
+        edges = graph.get_edge_array()
+        return cls.from_arrays(node_types, edges[:, 0], edges[:, 1], edge_types)
+
+    def append(self, sources, targets, source_types, target_types, relations=None, directed=False):
+
+        """
+        This function adds edges, e.g. the edges appended to a graph since the tables were built, without rebuilding the tables.
+        The new neighbours are kept per edge type in small arrays sorted by node, which are sampled together with the tables,
+        and merged into the tables once they hold more than an eighth of their neighbours, so adding k edges costs amortized
+        O(k log k) plus the size of the small arrays, independent of the number of nodes.
+
+        Parameters
+        ----------
+        sources, targets : ndarray
+            The node ilocs of the edges; ilocs beyond number_of_nodes add nodes.
+        source_types, target_types : ndarray
+            The node types of the sources and targets.
+        relations : ndarray, optional
+            The relation of every edge; if None every edge matches every relation.
+        directed : bool
+            If False, an edge (u, v) also makes u a neighbour of v.
+
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        if len(sources) == 0:
+            return
+        self.number_of_nodes = max(self.number_of_nodes, int(max(sources.max(), targets.max())) + 1)
+        source_types, target_types = np.asarray(source_types), np.asarray(target_types)
+        for edge_type in self.tables:
+            rows, cols = self._pairs(edge_type, sources, targets, source_types, target_types, relations, directed)
+            if len(rows) == 0:
+                continue
+            order = np.argsort(rows, kind='stable')
+            rows, cols = rows[order], cols[order].astype(np.int32)
+            if edge_type in self._pending:
+                pending_rows, pending_cols = self._pending[edge_type]
+                positions = np.searchsorted(pending_rows, rows, side='right')
+                rows, cols = np.insert(pending_rows, positions, rows), np.insert(pending_cols, positions, cols)
+            self._pending[edge_type] = (rows, cols)
+        pending = sum(len(rows) for rows, _ in self._pending.values())
+        if pending > max(2**16, sum(len(targets) for _, targets in self.tables.values())//8):
+            self._merge()
+
+    def _merge(self):
+        # Rebuilds the tables of the edge types with pending neighbours, for all nodes.
+        n = self.number_of_nodes
+        for edge_type, (pending_rows, pending_cols) in self._pending.items():
+            offsets, targets = self.tables[edge_type]
+            rows = np.concatenate((np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)), pending_rows))
+            cols = np.concatenate((targets, pending_cols))
+            order = np.lexsort((cols, rows))
+            offsets = np.zeros(n+1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=n), out=offsets[1:])
+            self.tables[edge_type] = (offsets, cols[order].astype(np.int32))
+        self._pending = {}
+
+    def sample(self, edge_type, nodes, n, rng):
+
+        """
+        This function samples n neighbours with replacement of edge type edge_type for every node.
+        It returns an int64 array of shape (len(nodes), n), with -1 where a node has no such neighbours
+        (or is itself -1), as StellarGraph's samplers do.
+
+        Parameters
+        ----------
+        edge_type : tuple
+            The edge type (source type, relation, target type).
+        nodes : ndarray
+            The node ilocs to sample neighbours for.
+        n : int
+            The number of samples per node.
+        rng : numpy Generator
+            The random generator.
+
+        """
+        offsets, targets = self.tables[tuple(edge_type)]
+        nodes = np.asarray(nodes, dtype=np.int64)
+        valid = (nodes >= 0) & (nodes < len(offsets) - 1)
+        start = np.where(valid, offsets[np.where(valid, nodes, 0)], 0)
+        degree = np.where(valid, offsets[np.where(valid, nodes, 0) + 1], 0) - start
+        pending = self._pending.get(tuple(edge_type))
+        if pending is None:
+            draws = (rng.random((len(nodes), n)) * degree[:, None]).astype(np.int64)
+            samples = np.full((len(nodes), n), -1, dtype=np.int64)
+            found = degree > 0
+            samples[found] = targets[start[found, None] + draws[found]]
+            return samples
+        # Neighbours added since the tables were built follow those in the tables.
+        pending_rows, pending_cols = pending
+        pending_start = np.searchsorted(pending_rows, nodes, side='left')
+        total = degree + np.searchsorted(pending_rows, nodes, side='right') - pending_start
+        draws = (rng.random((len(nodes), n)) * total[:, None]).astype(np.int64)
+        samples = np.full((len(nodes), n), -1, dtype=np.int64)
+        found = (total > 0)[:, None] & (nodes >= 0)[:, None]
+        in_tables = found & (draws < degree[:, None])
+        samples[in_tables] = targets[(start[:, None] + draws)[in_tables]]
+        in_pending = found & ~in_tables
+        samples[in_pending] = pending_cols[(pending_start[:, None] + draws - degree[:, None])[in_pending]]
+        return samples
+
+    def sample_tree(self, head_nodes, type_adjacency_list, schema, num_samples, rng):
+
+        """
+        This function samples the HinSAGE neighbourhood trees of a batch of head nodes.
+        It returns one int64 array per entry of type_adjacency_list, of shape (len(head_nodes), number of
+        sampled nodes in that slot), in the order and layout HinSAGENodeGenerator feeds to the HinSAGE model.
+
+        Parameters
+        ----------
+        head_nodes : ndarray
+            The head node ilocs.
+        type_adjacency_list : list of (str, list of int)
+            The sampling tree as given by GraphSchema.type_adjacency_list: the node type of every slot and
+            the indices of its child slots, one child per edge type of schema[node type], in order.
+        schema : dict(str, list of edge types)
+            The edge types per source node type, e.g. GraphSchema.schema.
+        num_samples : list
+            The number of samples per hop.
+        rng : numpy Generator
+            The random generator.
+
+        """
+        head_nodes = np.asarray(head_nodes, dtype=np.int64)
+        batch_size = len(head_nodes)
+        slots = [None]*len(type_adjacency_list)
+        depths = [0]*len(type_adjacency_list)
+        slots[0] = head_nodes.reshape(batch_size, 1)
+        for index, (node_type, children) in enumerate(type_adjacency_list):
+            for edge_type, child in zip(schema[node_type], children):
+                depths[child] = depths[index] + 1
+                n = num_samples[depths[index]]
+                samples = self.sample(edge_type, slots[index].ravel(), n, rng)
+                slots[child] = samples.reshape(batch_size, -1)
+        return slots
@@ -4,14 +4,17 @@ Created on Thu Jun 11 12:15:40 2020
 
 @author: Charles
 """
-from datetime import timedelta
-import dateparser
+import numpy as np
 import pandas as pd
 
+NANOSECONDS_PER_DAY = 24*60*60*10**9
+
 class Timeframes:
 
     """
     This class initializes the a rolling window timeframe configuration.
+    The dates are parsed once into a sorted int64 (nanosecond) timestamp array, so that window
+    and hold-out queries are answered with binary searches as contiguous slices.
     
     Parameters
     ----------
@@ -29,10 +32,40 @@ class Timeframes:
         
         
         self.date_column = pd.DataFrame(date_column)
+        date_column_name = list(self.date_column.columns)[0]
+        self.date_column[date_column_name] = pd.to_datetime(self.date_column[date_column_name])
         self.step_size = step_size
         self.window_size = window_size
+
+        timestamps = self.date_column[date_column_name].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        self._chronological = bool(np.all(timestamps[1:] >= timestamps[:-1]))
+        self._order = np.arange(len(timestamps)) if self._chronological else np.argsort(timestamps, kind='stable')
+        self._timestamps = timestamps[self._order]
+        self._sorted_index = self.date_column.index[self._order]
         
-    
+    @staticmethod
+    def _day(timestamp):
+        # midnight of the day of a nanosecond timestamp
+        return timestamp - timestamp % NANOSECONDS_PER_DAY
+
+    def _labels(self, start, end):
+        # index labels of the sorted positions [start, end), in the original record order
+        if self._chronological:
+            return self._sorted_index[start:end]
+        return self.date_column.index[np.sort(self._order[start:end])]
+
+    def _window(self, timeframe):
+        first_day = self._day(self._timestamps[0])
+        st = (timeframe-1)*self.step_size
+        start = np.searchsorted(self._timestamps, first_day + st*NANOSECONDS_PER_DAY, side='left')
+        end = np.searchsorted(self._timestamps, first_day + (self.window_size+st)*NANOSECONDS_PER_DAY, side='left')
+        return int(start), int(end)
+
+    def _hold_out(self, start, end, hold_out_days):
+        # position in [start, end) of the first record of the last hold_out_days days of the window
+        end_date = self._day(self._timestamps[end-1]) + NANOSECONDS_PER_DAY
+        return int(np.searchsorted(self._timestamps[start:end], end_date - hold_out_days*NANOSECONDS_PER_DAY, side='left')) + start
+
     def get_number_of_days(self):
         
         """
@@ -41,8 +74,7 @@ class Timeframes:
         
         """
         
-        date_column_name = list(self.date_column.columns)[0]
-        return (max(self.date_column[date_column_name])-min(self.date_column[date_column_name])).days
+        return int((self._timestamps[-1] - self._timestamps[0]) // NANOSECONDS_PER_DAY)
     
     def get_number_of_timeframes(self):
         
@@ -68,13 +100,17 @@ class Timeframes:
         if hold_out_days > self.window_size:
             raise ValueError("the number of hold out days cannot be larger than the total number of days in the window.")
             return
-        date_column_name = list(self.date_column.columns)[0]
-        timeframe_data = self.date_column.loc[data.index]
-        end_date = dateparser.parse(max(timeframe_data[date_column_name]).strftime('%Y-%m-%d'))+timedelta(1)
-        train_indices = (timeframe_data[timeframe_data[date_column_name] < (end_date-timedelta(hold_out_days))]).index
-        inductive_indices = (timeframe_data[timeframe_data[date_column_name] >= (end_date-timedelta(hold_out_days))]).index
-
-        return data.loc[train_indices], data.loc[inductive_indices]
+        positions = self.date_column.index.get_indexer(data.index)
+        if (positions < 0).any():
+            raise KeyError("%d rows of the data are not in the dates of the timeframes." % np.sum(positions < 0))
+        timestamps = self.date_column.iloc[:, 0].to_numpy(dtype='datetime64[ns]').view(np.int64)[positions]
+        end_date = self._day(timestamps.max()) + NANOSECONDS_PER_DAY
+        cutoff = end_date - hold_out_days*NANOSECONDS_PER_DAY
+        if np.all(timestamps[1:] >= timestamps[:-1]):
+            split = int(np.searchsorted(timestamps, cutoff, side='left'))
+            return data.iloc[:split], data.iloc[split:]
+        inductive = timestamps >= cutoff
+        return data[~inductive], data[inductive]
     
     
     def get_timeframe_indices(self, timeframe):
@@ -87,13 +123,23 @@ class Timeframes:
             The numeric identifier of the timeframe for which the indices are requested. 
 
         """       
-        date_column_name = list(self.date_column.columns)[0]
-        self.date_column[date_column_name] = pd.to_datetime(self.date_column[date_column_name])
-        start_date = dateparser.parse(min(self.date_column[date_column_name]).strftime('%Y-%m-%d'))
-        st = (timeframe-1)*self.step_size
-        timeframe_records = self.date_column[self.date_column[date_column_name] >= start_date +timedelta(st)]
-        timeframe_records = timeframe_records[timeframe_records[date_column_name] < (start_date + (timedelta(self.window_size+st)))]
+        start, end = self._window(timeframe)
+        return self._labels(start, end)
 
+    def iter_timeframes(self, hold_out_days):
+        """
+        This function yields, for every timeframe, the timeframe number and the train and inductive indices
+        of the records of that timeframe, as train_inductive_split would split them.
         
-        return timeframe_records.index  
-       
\ No newline at end of file
+        Parameters
+        ----------
+        hold_out_days : int
+            The number of days that should be held out of the train set.
+
+        """       
+        if hold_out_days > self.window_size:
+            raise ValueError("the number of hold out days cannot be larger than the total number of days in the window.")
+        for timeframe in range(1, self.get_number_of_timeframes()+1):
+            start, end = self._window(timeframe)
+            split = self._hold_out(start, end, hold_out_days) if end > start else start
+            yield timeframe, self._labels(start, split), self._labels(split, end)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 16:02:11 2026
+
+@author: Charles
+
+"""
+import numpy as np
+import pytest
+from sklearn.metrics import average_precision_score
+
+from inductiveGRL.evaluation import StreamingEvaluation
+
+def _data(pure, seed=0):
+    # probabilities of 10000 records in 64 bins; with pure bins every bin holds records of one label only
+    rng = np.random.default_rng(seed)
+    probabilities = rng.random(10000)
+    if pure:
+        labels = (rng.random(64) < 0.3)[(probabilities*64).astype(int)].astype(int)
+    else:
+        labels = (rng.random(10000) < probabilities**2).astype(int)
+    return probabilities, labels
+
+@pytest.mark.parametrize('pure', [True, False])
+def test_average_precision_within_bounds(pure):
+    probabilities, labels = _data(pure)
+    estimate, lower, upper = StreamingEvaluation('test', bins=64).update(probabilities, labels).average_precision()
+    exact = average_precision_score(labels, probabilities)
+    assert lower <= estimate <= upper
+    assert lower - 1e-12 <= exact <= upper + 1e-12
+    if pure:
+        assert estimate == pytest.approx(exact)
+
+def test_average_precision_is_expected_over_orders_within_bins():
+    # a bin of 3 negatives ranked above a bin of 2 positives: the estimate is exact when a bin is pure
+    evaluation = StreamingEvaluation('test', bins=4).update([0.9, 0.9, 0.9, 0.1, 0.1], [0, 0, 0, 1, 1])
+    estimate, lower, upper = evaluation.average_precision()
+    assert estimate == lower == upper == pytest.approx((1/4 + 2/5)/2)
+    # a mixed bin of 1 positive and 1 negative: the expected average precision of the two orders
+    estimate, lower, upper = StreamingEvaluation('test', bins=4).update([0.6, 0.6], [1, 0]).average_precision()
+    assert (lower, estimate, upper) == pytest.approx((0.5, 0.75, 1.0))
+
+def test_report_average_precision_within_bounds():
+    probabilities, labels = _data(False, seed=1)
+    report = StreamingEvaluation('test', bins=16).update(probabilities, labels).report(curve=False)
+    lower, upper = report['average_precision_bounds']
+    assert lower <= report['average_precision'] <= upper
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 16:40:27 2026
+
+@author: Charles
+
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+pytest.importorskip('stellargraph')
+from inductiveGRL.graphconstruction import GraphConstruction, NodeFeatures
+
+def _graph(features):
+    return GraphConstruction({'client': [1, 2], 'transaction': [10, 11]}, [[(1, 10), (2, 11)]], {'transaction': features})
+
+def _append(graph, features):
+    graph.append({'transaction': [12]}, [[(1, 12)]], {'transaction': features})
+    return graph.node_features['transaction']
+
+@pytest.mark.parametrize('values', [np.array([[1, 0], [0, 1]], dtype=np.int8), sparse.csr_matrix(np.eye(2))])
+def test_append_dataframe_to_node_features(values):
+    features = _append(_graph(NodeFeatures(values, index=[10, 11])), pd.DataFrame([[0.5, 2.0]], index=[12]))
+    assert isinstance(features, NodeFeatures)
+    np.testing.assert_array_equal(features.get([10, 11, 12]), [[1, 0], [0, 1], [0.5, 2]])
+
+def test_append_node_features_to_dataframe():
+    features = _append(_graph(pd.DataFrame([[1.0, 0.0], [0.0, 1.0]], index=[10, 11])), NodeFeatures(np.array([[3, 4]], dtype=np.int8), index=[12]))
+    assert isinstance(features, NodeFeatures)
+    np.testing.assert_array_equal(features.to_frame().to_numpy(), [[1, 0], [0, 1], [3, 4]])
+    assert list(features.index) == [10, 11, 12]
+
+def test_append_dataframes():
+    features = _append(_graph(pd.DataFrame([[1.0], [2.0]], index=[10, 11])), pd.DataFrame([[3.0]], index=[12]))
+    assert isinstance(features, pd.DataFrame)
+    assert list(features.index) == [10, 11, 12]